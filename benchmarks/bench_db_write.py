@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import asyncpg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import database
+
+load_dotenv()
+BENCH_SCHEMA = "bench_write"
+
+SCHEMA_SQL = """
+    CREATE TABLE chats (
+        chat_id VARCHAR(255) PRIMARY KEY,
+        title VARCHAR(255),
+        client_name VARCHAR(255),
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+        messages_synced_at TIMESTAMP WITH TIME ZONE
+    );
+    CREATE TABLE messages (
+        message_id VARCHAR(255) NOT NULL,
+        chat_id VARCHAR(255) NOT NULL REFERENCES chats(chat_id) ON DELETE CASCADE,
+        text TEXT,
+        is_from_company BOOLEAN,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (message_id, created_at)
+    ) PARTITION BY RANGE (created_at);
+    CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+"""
+
+async def legacy_save_chats_to_db(mapped_chats):
+    async with database.get_connection() as conn:
+        query = """
+            INSERT INTO chats (chat_id, title, client_name, created_at, updated_at)
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (chat_id)
+            DO UPDATE SET
+                updated_at = EXCLUDED.updated_at
+            WHERE EXCLUDED.updated_at > chats.updated_at
+            RETURNING xmax::text
+        """
+        for chat in mapped_chats:
+            await conn.fetchval(
+                query, chat['chat_id'], chat['title'], chat['client_name'],
+                chat['created_at'], chat['updated_at'],
+            )
+
+async def legacy_save_messages_to_db(messages_list):
+    async with database.get_connection() as conn:
+        query = """
+            INSERT INTO messages
+                (message_id, chat_id, text, is_from_company, created_at)
+            VALUES
+                ($1, $2, $3, $4, $5)
+            ON CONFLICT (message_id, created_at)
+            DO NOTHING
+        """
+        records = [
+            (msg['message_id'], msg['chat_id'], msg['text'], msg['is_from_company'], msg['created_at'])
+            for msg in messages_list
+        ]
+        await conn.executemany(query, records)
+
+def make_data(message_count, messages_per_chat=20):
+    start = datetime(2025, 1, 1)
+    chat_count = max(message_count // messages_per_chat, 1)
+    chats = [
+        {
+            'chat_id': f"u2i-{i}",
+            'title': f"Объявление {i}",
+            'client_name': f"Клиент {i}",
+            'created_at': start,
+            'updated_at': start + timedelta(minutes=i),
+        }
+        for i in range(chat_count)
+    ]
+    messages = [
+        {
+            'message_id': f"msg-{i}",
+            'chat_id': f"u2i-{i % chat_count}",
+            'text': "Здравствуйте! Товар еще в наличии? Можно забрать сегодня вечером?",
+            'is_from_company': i % 2 == 0,
+            'created_at': start + timedelta(seconds=i),
+        }
+        for i in range(message_count)
+    ]
+    return chats, messages
+
+async def reset_schema(conn):
+    await conn.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+    await conn.execute(SCHEMA_SQL)
+
+async def run_case(label, save_chats, save_messages, chats, messages, batch_size):
+    async with database.get_connection() as conn:
+        await reset_schema(conn)
+
+    started = time.perf_counter()
+    for i in range(0, len(chats), batch_size):
+        await save_chats(chats[i:i + batch_size])
+    chats_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for i in range(0, len(messages), batch_size):
+        await save_messages(messages[i:i + batch_size])
+    messages_elapsed = time.perf_counter() - started
+
+    print(f"  {label:<22} чаты: {chats_elapsed:8.2f} с   сообщения: {messages_elapsed:8.2f} с")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default="10000,100000,1000000")
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    database.pool_stats['batch'] = database.new_pool_stats()
+    database.db_pools['batch'] = await asyncpg.create_pool(
+        user=database.PG_USER,
+        password=database.PG_PASSWORD,
+        host=database.PG_HOST,
+        port=database.PG_PORT,
+        database=database.PG_DATABASE,
+        min_size=1,
+        max_size=1,
+        server_settings={'search_path': BENCH_SCHEMA},
+        init=database.make_pool_init('batch'),
+    )
+    try:
+        for size in (int(value) for value in args.sizes.split(',')):
+            chats, messages = make_data(size)
+            print(f"{size} сообщений, {len(chats)} чатов, пакет {args.batch_size}")
+            await run_case("executemany/fetchval", legacy_save_chats_to_db, legacy_save_messages_to_db,
+                           chats, messages, args.batch_size)
+            await run_case("COPY + merge", database.save_chats_to_db, database.save_messages_to_db,
+                           chats, messages, args.batch_size)
+    finally:
+        async with database.get_connection() as conn:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        await database.close_db_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
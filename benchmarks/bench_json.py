@@ -0,0 +1,67 @@
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import json_codec
+
+PHRASES = [
+    "Здравствуйте! Товар еще в наличии?",
+    "Да, в наличии. Можем отправить сегодня же.",
+    "А какая доставка до Казани и сколько стоит?",
+    "Доставка транспортной компанией, около 650 рублей, 3-4 дня.",
+    "Можно немного скинуть цену, если заберу сам?",
+    "Спасибо, подумаю и напишу вечером.",
+]
+
+def make_messages_page(count=100):
+    return {
+        "messages": [
+            {
+                "id": f"{random.getrandbits(64):x}",
+                "author_id": random.choice([111111, 222222]),
+                "created": 1727000000 + i * 60,
+                "direction": random.choice(["in", "out"]),
+                "type": "text",
+                "is_read": True,
+                "read": 1727000000 + i * 60 + 30,
+                "content": {"text": random.choice(PHRASES)},
+            }
+            for i in range(count)
+        ]
+    }
+
+def make_json_agg(count=100):
+    return [
+        {
+            "text": random.choice(PHRASES),
+            "is_from_company": random.choice([True, False]),
+            "created_at": f"2025-09-{(i % 28) + 1:02d}T12:{i % 60:02d}:00+03:00",
+        }
+        for i in range(count)
+    ]
+
+def bench(name, loads, payload, number):
+    seconds = timeit.timeit(lambda: loads(payload), number=number)
+    print(f"{name:<28} {seconds / number * 1e6:10.1f} мкс/декод")
+
+def main():
+    random.seed(42)
+    number = 2000
+    payloads = {
+        "Avito messages (100)": json.dumps(make_messages_page(100), ensure_ascii=False),
+        "json_agg диалога (100)": json.dumps(make_json_agg(100), ensure_ascii=False),
+        "json_agg диалога (1000)": json.dumps(make_json_agg(1000), ensure_ascii=False),
+    }
+
+    print(f"Быстрый кодек: {json_codec.CODEC_NAME}\n")
+    for label, payload in payloads.items():
+        print(f"{label}, {len(payload.encode()) // 1024} КБ")
+        bench("  json.loads", json.loads, payload, number)
+        bench(f"  json_codec.loads ({json_codec.CODEC_NAME})", json_codec.loads, payload, number)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import asyncpg
+from dotenv import load_dotenv
+
+load_dotenv()
+PG_HOST = os.getenv("PG_HOST")
+PG_PORT = os.getenv("PG_PORT")
+PG_DATABASE = os.getenv("PG_DATABASE")
+PG_USER = os.getenv("PG_USER")
+PG_PASSWORD = os.getenv("PG_PASSWORD")
+
+PLANS_SCHEMA = "bench_plans"
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), '..', 'migrations')
+
+SEED_CHATS_SQL = """
+    INSERT INTO chats (chat_id, title, client_name, created_at, updated_at)
+    SELECT 'u2i-' || i, 'Объявление ' || i, 'Клиент ' || i,
+           now() - interval '400 days' + i * interval '1 minute',
+           now() - (i % 525600) * interval '1 minute'
+    FROM generate_series(1, $1::int) AS i
+"""
+
+SEED_MESSAGES_SQL = """
+    INSERT INTO messages (message_id, chat_id, text, is_from_company, created_at)
+    SELECT 'm-' || i, 'u2i-' || (1 + i % $1::int),
+           'Здравствуйте! Товар еще в наличии? Можно забрать сегодня вечером?',
+           i % 2 = 0, now() - ((i::bigint * 7919) % 31536000) * interval '1 second'
+    FROM generate_series(1, $2::int) AS i
+"""
+
+SEED_REPORTS_SQL = """
+    INSERT INTO chat_reports (chat_id, created_at, chat_title, summary, recommendations)
+    SELECT 'u2i-' || i, now() - (i % 365) * interval '1 day' - (i % 1440) * interval '1 minute',
+           'Объявление ' || i, 'Итог', 'Рекомендации'
+    FROM generate_series(1, ($1::int * 9) / 10) AS i
+"""
+
+def hot_queries():
+    now = datetime.now().astimezone()
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return [
+        (
+            "get_chats_data_for_analysis",
+            """
+                SELECT chats.chat_id, chat_messages.messages, chat_messages.new_messages
+                FROM chats
+                LEFT JOIN chat_reports ON chats.chat_id = chat_reports.chat_id
+                LEFT JOIN LATERAL (
+                    SELECT json_agg(json_build_object(
+                        'text', messages.text,
+                        'is_from_company', messages.is_from_company,
+                        'created_at', messages.created_at,
+                        'is_new', messages.created_at > COALESCE(chat_reports.analyzed_until, chat_reports.created_at)
+                    ) ORDER BY messages.created_at ASC) AS messages,
+                    COUNT(messages.message_id) FILTER (WHERE messages.created_at > COALESCE(chat_reports.analyzed_until, chat_reports.created_at)) AS new_messages
+                    FROM messages
+                    WHERE messages.chat_id = chats.chat_id
+                ) chat_messages ON true
+                WHERE chats.chat_id = ANY($1::varchar[])
+            """,
+            [[f"u2i-{i}" for i in range(1, 51)]],
+            set(),
+        ),
+        (
+            "get_reports_from_db (день)",
+            """
+                SELECT * FROM chat_reports
+                WHERE created_at BETWEEN $1 AND $2
+                ORDER BY created_at DESC
+            """,
+            [day_start, now],
+            set(),
+        ),
+        (
+            "get_reports_from_db (неделя)",
+            """
+                SELECT * FROM chat_reports
+                WHERE created_at BETWEEN $1 AND $2
+                ORDER BY created_at DESC
+            """,
+            [day_start - timedelta(days=7), now],
+            set(),
+        ),
+        (
+            "count_reports_in_period",
+            "SELECT COUNT(*) FROM chat_reports WHERE created_at BETWEEN $1 AND $2",
+            [day_start - timedelta(days=7), now],
+            set(),
+        ),
+        (
+            "get_reports_page (первая)",
+            """
+                SELECT * FROM chat_reports
+                WHERE created_at BETWEEN $1 AND $2
+                ORDER BY created_at DESC, chat_id DESC
+                LIMIT 1
+            """,
+            [day_start - timedelta(days=7), now],
+            set(),
+        ),
+        (
+            "get_reports_page (курсор)",
+            """
+                SELECT * FROM chat_reports
+                WHERE created_at BETWEEN $1 AND $2
+                    AND (created_at, chat_id) < ($3, $4)
+                ORDER BY created_at DESC, chat_id DESC
+                LIMIT 1
+            """,
+            [day_start - timedelta(days=7), now, day_start - timedelta(days=3), "u2i-100"],
+            set(),
+        ),
+        (
+            "get_known_message_ids",
+            "SELECT message_id FROM messages WHERE message_id = ANY($1::varchar[])",
+            [[f"m-{i}" for i in range(1, 101)]],
+            set(),
+        ),
+        (
+            "search_dialogs (messages)",
+            """
+                SELECT chat_id, ts_rank(text_tsv, websearch_to_tsquery('russian', $1)) AS rank
+                FROM messages
+                WHERE text_tsv @@ websearch_to_tsquery('russian', $1)
+            """,
+            ["доставка задержка"],
+            set(),
+        ),
+        (
+            # Кандидаты на анализ выбираются соединением всех чатов со всеми отчетами,
+            # полный проход по обеим таблицам ожидаем
+            "get_chats_for_analysis",
+            """
+                SELECT chats.chat_id
+                FROM chats
+                LEFT JOIN chat_reports ON chats.chat_id = chat_reports.chat_id
+                WHERE chat_reports.chat_id IS NULL
+                    OR chats.updated_at > COALESCE(chat_reports.checked_at, chat_reports.created_at)
+                ORDER BY chats.updated_at DESC
+            """,
+            [],
+            {"chats", "chat_reports"},
+        ),
+    ]
+
+def find_seq_scans(plan):
+    seq_scans = []
+    if plan.get('Node Type') == 'Seq Scan':
+        seq_scans.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        seq_scans.extend(find_seq_scans(child))
+    return seq_scans
+
+def is_allowed(relation, allowed_tables):
+    return any(relation == table or relation.startswith(f"{table}_") for table in allowed_tables)
+
+async def get_empty_tables(conn):
+    # Seq Scan по пустой партиции (будущие месяцы, DEFAULT) ничего не читает
+    records = await conn.fetch(
+        """
+            SELECT relname FROM pg_class
+            WHERE relnamespace = $1::regnamespace AND relkind = 'r' AND reltuples <= 0
+        """,
+        PLANS_SCHEMA,
+    )
+    return {record['relname'] for record in records}
+
+async def apply_migrations(conn):
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, '*.sql'))):
+        if path.endswith('.rollback.sql'):
+            continue
+        with open(path, encoding='utf-8') as f:
+            sql = f.read()
+        if '-- transactional: false' not in sql:
+            await conn.execute(sql)
+            continue
+        for statement in sql.split(';'):
+            statement = "\n".join(line for line in statement.splitlines() if not line.strip().startswith('--'))
+            if statement.strip():
+                await conn.execute(statement)
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=50000)
+    parser.add_argument('--messages', type=int, default=1200000)
+    parser.add_argument('--keep', action='store_true')
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(
+        user=PG_USER,
+        password=PG_PASSWORD,
+        host=PG_HOST,
+        port=PG_PORT,
+        database=PG_DATABASE,
+        server_settings={'search_path': PLANS_SCHEMA},
+    )
+    failed = False
+    try:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {PLANS_SCHEMA} CASCADE")
+        await conn.execute(f"CREATE SCHEMA {PLANS_SCHEMA}")
+        await apply_migrations(conn)
+        await conn.execute("""
+            SELECT create_messages_partition((date_trunc('month', CURRENT_TIMESTAMP) - month_offset * interval '1 month')::date)
+            FROM generate_series(1, 13) AS month_offset
+        """)
+
+        print(f"Заполнение: {args.chats} чатов, {args.messages} сообщений...")
+        await conn.execute(SEED_CHATS_SQL, args.chats)
+        await conn.execute(SEED_MESSAGES_SQL, args.chats, args.messages)
+        await conn.execute(SEED_REPORTS_SQL, args.chats)
+        await conn.execute("VACUUM ANALYZE chats, messages, chat_reports")
+        empty_tables = await get_empty_tables(conn)
+
+        for name, query, params, allowed_tables in hot_queries():
+            explain = await conn.fetchval(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}", *params)
+            plan = json.loads(explain)[0]
+            seq_scans = [
+                relation for relation in find_seq_scans(plan['Plan'])
+                if relation not in empty_tables and not is_allowed(relation, allowed_tables)
+            ]
+            status = "OK  " if not seq_scans else "FAIL"
+            print(f"{status} {name:<32} {plan['Execution Time']:9.2f} мс  {plan['Plan']['Node Type']}")
+            if seq_scans:
+                failed = True
+                print(f"     Seq Scan: {', '.join(seq_scans)}")
+    finally:
+        if not args.keep:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {PLANS_SCHEMA} CASCADE")
+        await conn.close()
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    asyncio.run(main())
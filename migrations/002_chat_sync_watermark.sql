@@ -0,0 +1,2 @@
+ALTER TABLE chats
+ADD COLUMN messages_synced_at TIMESTAMP WITH TIME ZONE;
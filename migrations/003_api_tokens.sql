@@ -0,0 +1,6 @@
+CREATE TABLE api_tokens (
+    name VARCHAR(255) PRIMARY KEY,
+    access_token TEXT NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,16 @@
+-- transactional: false
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_chat_id_created_at
+    ON messages (chat_id, created_at)
+    INCLUDE (is_from_company);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chat_reports_created_at_chat_id
+    ON chat_reports (created_at, chat_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chat_reports_chat_id_created_at
+    ON chat_reports (chat_id)
+    INCLUDE (created_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chats_updated_at
+    ON chats (updated_at DESC)
+    INCLUDE (chat_id);
@@ -0,0 +1,8 @@
+CREATE TABLE fsm_storage (
+    key VARCHAR(255) PRIMARY KEY,
+    state VARCHAR(255),
+    data JSONB NOT NULL DEFAULT '{}'::jsonb,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_fsm_storage_updated_at ON fsm_storage (updated_at);
@@ -0,0 +1,25 @@
+CREATE TABLE report_daily_stats (
+    day DATE NOT NULL,
+    criterion VARCHAR(64) NOT NULL,
+    grade VARCHAR(255) NOT NULL,
+    report_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, criterion, grade)
+);
+
+INSERT INTO report_daily_stats (day, criterion, grade, report_count)
+SELECT
+    chat_reports.created_at::date,
+    grades.criterion,
+    COALESCE(grades.grade, ''),
+    COUNT(*)
+FROM chat_reports
+CROSS JOIN LATERAL (
+    VALUES
+        ('tonality', chat_reports.tonality_grade),
+        ('professionalism', chat_reports.professionalism_grade),
+        ('clarity', chat_reports.clarity_grade),
+        ('problem_solving', chat_reports.problem_solving_grade),
+        ('objection_handling', chat_reports.objection_handling_grade),
+        ('closure', chat_reports.closure_grade)
+) AS grades (criterion, grade)
+GROUP BY 1, 2, 3;
@@ -0,0 +1,50 @@
+ALTER TABLE messages RENAME TO messages_legacy;
+ALTER TABLE messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey;
+ALTER INDEX IF EXISTS idx_messages_chat_id_created_at RENAME TO idx_messages_legacy_chat_id_created_at;
+
+CREATE TABLE messages (
+    message_id VARCHAR(255) NOT NULL,
+    chat_id VARCHAR(255) NOT NULL REFERENCES chats(chat_id) ON DELETE CASCADE,
+    text TEXT,
+    is_from_company BOOLEAN,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (message_id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE INDEX idx_messages_chat_id_created_at
+    ON messages (chat_id, created_at)
+    INCLUDE (is_from_company);
+
+CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+
+CREATE OR REPLACE FUNCTION create_messages_partition(month_start DATE)
+RETURNS TEXT AS $$
+DECLARE
+    partition_name TEXT := format('messages_%s', to_char(month_start, 'YYYY_MM'));
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+        partition_name,
+        date_trunc('month', month_start),
+        date_trunc('month', month_start) + interval '1 month'
+    );
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    month_start DATE;
+BEGIN
+    month_start := date_trunc('month', COALESCE((SELECT MIN(created_at) FROM messages_legacy), CURRENT_TIMESTAMP))::date;
+    WHILE month_start <= date_trunc('month', CURRENT_TIMESTAMP + interval '3 months') LOOP
+        PERFORM create_messages_partition(month_start);
+        month_start := (month_start + interval '1 month')::date;
+    END LOOP;
+END $$;
+
+INSERT INTO messages (message_id, chat_id, text, is_from_company, created_at)
+SELECT message_id, chat_id, text, is_from_company, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM messages_legacy;
+
+DROP TABLE messages_legacy;
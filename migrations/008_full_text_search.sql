@@ -0,0 +1,14 @@
+ALTER TABLE messages
+ADD COLUMN text_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('russian', COALESCE(text, ''))) STORED;
+
+CREATE INDEX idx_messages_text_tsv ON messages USING GIN (text_tsv);
+
+ALTER TABLE chat_reports
+ADD COLUMN report_tsv tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', COALESCE(summary, '')), 'A') ||
+        setweight(to_tsvector('russian', COALESCE(recommendations, '')), 'B')
+    ) STORED;
+
+CREATE INDEX idx_chat_reports_report_tsv ON chat_reports USING GIN (report_tsv);
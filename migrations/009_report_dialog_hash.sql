@@ -0,0 +1,12 @@
+ALTER TABLE chat_reports
+ADD COLUMN dialog_hash VARCHAR(64),
+ADD COLUMN prompt_version VARCHAR(64),
+ADD COLUMN checked_at TIMESTAMP WITH TIME ZONE;
+
+UPDATE chat_reports SET checked_at = created_at;
+
+DROP INDEX IF EXISTS idx_chat_reports_chat_id_created_at;
+
+CREATE INDEX idx_chat_reports_chat_id_checked_at
+    ON chat_reports (chat_id)
+    INCLUDE (created_at, checked_at);
@@ -0,0 +1,6 @@
+ALTER TABLE chat_reports
+ADD COLUMN analysis_mode VARCHAR(20) NOT NULL DEFAULT 'full',
+ADD COLUMN incremental_runs INT NOT NULL DEFAULT 0,
+ADD COLUMN full_analyzed_at TIMESTAMP WITH TIME ZONE;
+
+UPDATE chat_reports SET full_analyzed_at = created_at;
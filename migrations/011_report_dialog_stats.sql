@@ -0,0 +1,5 @@
+ALTER TABLE chat_reports
+ADD COLUMN dialog_tokens INT DEFAULT 0,
+ADD COLUMN trimmed_tokens INT DEFAULT 0,
+ADD COLUMN trimmed_messages INT DEFAULT 0,
+ADD COLUMN deduplicated_messages INT DEFAULT 0;
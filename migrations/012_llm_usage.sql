@@ -0,0 +1,13 @@
+CREATE TABLE llm_usage (
+    id BIGSERIAL PRIMARY KEY,
+    run_id VARCHAR(36) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    chat_ids VARCHAR(255)[] NOT NULL,
+    analysis_mode VARCHAR(20) NOT NULL,
+    prompt_tokens INT NOT NULL DEFAULT 0,
+    completion_tokens INT NOT NULL DEFAULT 0,
+    cached_tokens INT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX idx_llm_usage_run_id ON llm_usage (run_id);
+CREATE INDEX idx_llm_usage_created_at ON llm_usage (created_at);
@@ -0,0 +1,10 @@
+ALTER TABLE chat_reports
+ADD COLUMN analyzed_until TIMESTAMP WITH TIME ZONE;
+
+UPDATE chat_reports
+SET analyzed_until = (
+    SELECT MAX(messages.created_at)
+    FROM messages
+    WHERE messages.chat_id = chat_reports.chat_id
+        AND messages.created_at <= chat_reports.created_at
+);
@@ -0,0 +1,5 @@
+CREATE TABLE message_archive_watermark (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    archived_before TIMESTAMP WITH TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
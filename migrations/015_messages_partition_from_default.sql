@@ -0,0 +1,40 @@
+-- Если в партиции по умолчанию уже есть строки за месяц, CREATE TABLE ... PARTITION OF
+-- падает, поэтому такие строки переносятся в новую партицию
+CREATE OR REPLACE FUNCTION create_messages_partition(month_start DATE)
+RETURNS TEXT AS $$
+DECLARE
+    partition_name TEXT := format('messages_%s', to_char(month_start, 'YYYY_MM'));
+    range_start TIMESTAMP WITH TIME ZONE := date_trunc('month', month_start);
+    range_end TIMESTAMP WITH TIME ZONE := date_trunc('month', month_start) + interval '1 month';
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM messages_default WHERE created_at >= range_start AND created_at < range_end) THEN
+        CREATE TEMP TABLE messages_moved ON COMMIT DROP AS
+        SELECT message_id, chat_id, text, is_from_company, created_at
+        FROM messages_default
+        WHERE created_at >= range_start AND created_at < range_end;
+
+        DELETE FROM messages_default WHERE created_at >= range_start AND created_at < range_end;
+
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+            partition_name, range_start, range_end
+        );
+
+        INSERT INTO messages (message_id, chat_id, text, is_from_company, created_at)
+        SELECT message_id, chat_id, text, is_from_company, created_at FROM messages_moved;
+
+        DROP TABLE messages_moved;
+    ELSE
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+            partition_name, range_start, range_end
+        );
+    END IF;
+
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
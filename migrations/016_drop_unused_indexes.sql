@@ -0,0 +1,7 @@
+-- transactional: false
+
+-- get_chats_for_analysis проходит все чаты и отчеты целиком, индекс по updated_at не используется
+DROP INDEX CONCURRENTLY IF EXISTS idx_chats_updated_at;
+
+-- Дублирует уникальный индекс chat_reports_chat_id_unique
+DROP INDEX CONCURRENTLY IF EXISTS idx_chat_reports_chat_id_checked_at;
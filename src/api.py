@@ -1,6 +1,10 @@
-from fastapi import FastAPI, Request, HTTPException, Header, Depends
+from fastapi import FastAPI, Request, HTTPException, Header, Depends, BackgroundTasks
+import hmac
 import logging
 import database
+import http_client
+import avito
+import utils
 import uvicorn
 import os
 from dotenv import load_dotenv
@@ -15,26 +19,48 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 VALID_API_KEY = os.getenv("APIKEY")
 WEBHOOK = os.getenv("WEBHOOK_URL")
+USER_ID = os.getenv("AVITO_USER_ID")
+AVITO_WEBHOOK = os.getenv("AVITO_WEBHOOK_URL")
+AVITO_WEBHOOK_SECRET = os.getenv("AVITO_WEBHOOK_SECRET")
 
 scheduler = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global scheduler
+    if AVITO_WEBHOOK and not AVITO_WEBHOOK_SECRET:
+        raise RuntimeError("AVITO_WEBHOOK_URL задан без AVITO_WEBHOOK_SECRET, вебхук Avito не будет защищен")
     try:
         await database.create_db_pool()
+        await http_client.create_http_session()
         scheduler = setup_scheduler()
         scheduler.start()
         await bot.set_webhook(WEBHOOK)
+        if AVITO_WEBHOOK:
+            await subscribe_avito_webhook()
         yield
     finally:
         await database.close_db_pool()
+        await http_client.close_http_session()
         scheduler.shutdown() 
         await bot.delete_webhook()
         await bot.session.close()
             
 app = FastAPI(lifespan=lifespan)
 
+async def subscribe_avito_webhook():
+    try:
+        token = await avito.get_avito_token()
+        await avito.subscribe_avito_webhook(token, AVITO_WEBHOOK)
+    except Exception as e:
+        logger.error(f"Ошибка подписки на вебхук Avito: {e}")
+
+async def save_avito_webhook_message(message):
+    try:
+        await database.save_webhook_message_to_db(message)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения сообщения {message['message_id']} из вебхука Avito: {e}")
+
 async def verify_api_key(apikey: str = Header(...)):
     if apikey != VALID_API_KEY:
         raise HTTPException(
@@ -50,9 +76,32 @@ async def telegram_webhook(request: Request):
     await dp.feed_update(bot=bot, update=telegram_update)
     return {"status": "ok"}
 
+@app.post("/avito/webhook")
+async def avito_webhook(request: Request, background_tasks: BackgroundTasks, token: str = ""):
+    if not AVITO_WEBHOOK_SECRET:
+        raise HTTPException(status_code=404, detail="Вебхук Avito не настроен")
+    if not hmac.compare_digest(token.encode(), AVITO_WEBHOOK_SECRET.encode()):
+        raise HTTPException(status_code=401, detail="Неверный токен вебхука")
+
+    try:
+        webhook_data = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный JSON")
+    if not isinstance(webhook_data, dict):
+        raise HTTPException(status_code=400, detail="Некорректный формат вебхука")
+
+    message = utils.map_avito_webhook_message(webhook_data, USER_ID)
+    if message:
+        background_tasks.add_task(save_avito_webhook_message, message)
+    return {"status": "ok"}
+
+@app.get("/stats/db")
+async def get_db_stats(verified: bool = Depends(verify_api_key)):
+    return database.get_pool_stats()
+
 @app.post("/sync/avito")
-async def trigger_avito_sync(verified: bool = Depends(verify_api_key)):
-    await main_avito_data()
+async def trigger_avito_sync(full_resync: bool = False, verified: bool = Depends(verify_api_key)):
+    await main_avito_data(full_resync=full_resync)
 
 @app.post("/llm/analyze")
 async def trigger_llm_analyze(verified: bool = Depends(verify_api_key)):
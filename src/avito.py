@@ -1,9 +1,14 @@
 import os
+import asyncio
 import logging
+import database
+import json_codec
+from datetime import datetime, timedelta, timezone
 from cachetools import TTLCache
-import aiohttp
 from dotenv import load_dotenv
-from retry_config import api_retry
+from retry_config import api_retry, raise_for_retryable
+from http_client import get_http_session
+import rate_limit
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -11,15 +16,18 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 CLIENT_ID = os.getenv("AVITO_CLIENT_ID")
 CLIENT_SECRET = os.getenv("AVITO_CLIENT_SECRET")
+CHATS_PAGE_SIZE = int(os.getenv("AVITO_CHATS_PAGE_SIZE", 100))
+CHATS_PREFETCH = os.getenv("AVITO_CHATS_PREFETCH", "true").lower() == "true"
+MESSAGES_PAGE_SIZE = int(os.getenv("AVITO_MESSAGES_PAGE_SIZE", 100))
+
+TOKEN_REFRESH_MARGIN = timedelta(minutes=int(os.getenv("AVITO_TOKEN_REFRESH_MARGIN", 30)))
 
 token_cache = TTLCache(maxsize=1, ttl=23.5 * 60 * 60)
+token_lock = asyncio.Lock()
+token_refresh_task = None
 
 @api_retry
-async def get_avito_token():
-    if 'avito_token' in token_cache:
-        logger.info("Используется кешированный токен")
-        return token_cache['avito_token']
-    
+async def request_avito_token():
     logger.info("Запрашивается новый токен")
 
     data_api = {
@@ -27,39 +35,149 @@ async def get_avito_token():
         'client_secret': CLIENT_SECRET,
         'grant_type': 'client_credentials'
     }
-    async with aiohttp.ClientSession() as session:   
-        async with session.post(
-            "https://api.avito.ru/token",
-            data=data_api,
-        ) as response:
-            token_data = await response.json()
-            new_token = token_data["access_token"]
-            token_cache['avito_token'] = new_token
-            return new_token
+    url = "https://api.avito.ru/token"
+    await rate_limit.acquire(url)
+    session = get_http_session()
+    async with session.post(
+        url,
+        data=data_api,
+    ) as response:
+        raise_for_retryable(response)
+        token_data = await response.json(loads=json_codec.loads)
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=token_data.get("expires_in", 86400))
+        return token_data["access_token"], expires_at
+
+def token_is_fresh(token_entry, margin=TOKEN_REFRESH_MARGIN):
+    return token_entry is not None and token_entry[1] - datetime.now(timezone.utc) > margin
+
+async def refresh_avito_token():
+    async with token_lock:
+        token_entry = token_cache.get('avito_token')
+        if token_is_fresh(token_entry):
+            return token_entry[0]
+
+        try:
+            stored = await database.get_api_token('avito')
+        except Exception as e:
+            logger.error(f"Ошибка чтения токена из БД: {e}")
+            stored = None
+
+        if stored and token_is_fresh((stored['access_token'], stored['expires_at'])):
+            logger.info("Используется токен из БД")
+            token_entry = (stored['access_token'], stored['expires_at'])
+        else:
+            token_entry = await request_avito_token()
+            try:
+                await database.save_api_token('avito', *token_entry)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения токена в БД: {e}")
+
+        token_cache['avito_token'] = token_entry
+        return token_entry[0]
+
+async def refresh_avito_token_in_background():
+    try:
+        await refresh_avito_token()
+    except Exception as e:
+        logger.error(f"Ошибка фонового обновления токена: {e}")
+
+async def get_avito_token():
+    global token_refresh_task
+    token_entry = token_cache.get('avito_token')
+
+    if token_is_fresh(token_entry):
+        logger.info("Используется кешированный токен")
+        return token_entry[0]
+
+    if token_is_fresh(token_entry, margin=timedelta(0)):
+        if token_refresh_task is None or token_refresh_task.done():
+            logger.info("Токен скоро истечет, запускаю фоновое обновление")
+            token_refresh_task = asyncio.create_task(refresh_avito_token_in_background())
+        return token_entry[0]
+
+    return await refresh_avito_token()
 
 @api_retry        
-async def get_avito_chats(access_token, USER_ID):
+async def get_avito_chats(access_token, USER_ID, limit=100, offset=0):
     headers =  {'Authorization': f'Bearer {access_token}'}
-    params = {'limit': 100,'offset': 0}
+    params = {'limit': limit,'offset': offset}
     url = f"https://api.avito.ru/messenger/v2/accounts/{USER_ID}/chats"
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers, params=params) as response:
-            raw_chats = await response.json()
-            return raw_chats           
+    await rate_limit.acquire(url)
+    session = get_http_session()
+    async with session.get(url, headers=headers, params=params) as response:
+        raise_for_retryable(response)
+        raw_chats = await response.json(loads=json_codec.loads)
+        return raw_chats
+
+async def iter_avito_chats(access_token, USER_ID, page_size=CHATS_PAGE_SIZE, prefetch=CHATS_PREFETCH):
+    offset = 0
+    next_page = asyncio.ensure_future(get_avito_chats(access_token, USER_ID, page_size, offset))
+    try:
+        while next_page is not None:
+            raw_chats = await next_page
+            page_len = len(raw_chats.get('chats', []))
+            offset += page_len
+            has_more = page_len == page_size
+
+            next_page = None
+            if has_more and prefetch:
+                next_page = asyncio.ensure_future(get_avito_chats(access_token, USER_ID, page_size, offset))
+
+            yield raw_chats
+
+            if has_more and not prefetch:
+                next_page = asyncio.ensure_future(get_avito_chats(access_token, USER_ID, page_size, offset))
+    finally:
+        if next_page is not None and not next_page.done():
+            next_page.cancel()
 
 @api_retry        
-async def get_avito_messages(access_token, chat_id, USER_ID):
+async def get_avito_messages(access_token, chat_id, USER_ID, limit=100, offset=0):
     headers = {'Authorization': f'Bearer {access_token}'}
-    params = {'limit': 100, 'offset': 0}
+    params = {'limit': limit, 'offset': offset}
     url = f"https://api.avito.ru/messenger/v3/accounts/{USER_ID}/chats/{chat_id}/messages"
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers, params=params) as response:
+    await rate_limit.acquire(url)
+    session = get_http_session()
+    async with session.get(url, headers=headers, params=params) as response:
+        raise_for_retryable(response)
+
+        if response.status == 404:
+            logger.warning(f"Чат {chat_id} не найден в Avito, сообщения не загружены")
+            return {"messages": []}
+        response.raise_for_status()
+        
+        raw_messages = await response.json(loads=json_codec.loads)
+        return raw_messages
+
+async def iter_avito_messages(access_token, chat_id, USER_ID, page_size=MESSAGES_PAGE_SIZE):
+    offset = 0
+    while True:
+        raw_messages = await get_avito_messages(access_token, chat_id, USER_ID, page_size, offset)
+        page_len = len(raw_messages.get('messages', []))
+        if page_len == 0:
+            return
+
+        yield raw_messages
+
+        if page_len < page_size:
+            return
+        offset += page_len
+
+@api_retry
+async def subscribe_avito_webhook(access_token, webhook_url):
+    headers = {'Authorization': f'Bearer {access_token}'}
+    url = "https://api.avito.ru/messenger/v3/webhook"
+
+    await rate_limit.acquire(url)
+    session = get_http_session()
+    async with session.post(url, headers=headers, json={'url': webhook_url}) as response:
+        raise_for_retryable(response)
+
+        if response.status != 200:
+            logger.error(f"HTTP {response.status} при подписке на вебхук Avito")
+            return False
 
-            if response.status != 200:
-                logger.error(f"HTTP {response.status} для чата {chat_id}")
-                return {"messages": []}
-            
-            raw_messages = await response.json()
-            return raw_messages 
\ No newline at end of file
+        logger.info("Вебхук Avito зарегистрирован")
+        return True
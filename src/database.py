@@ -1,9 +1,13 @@
 import asyncpg
-import json
+import gzip
+import json_codec
 from contextlib import asynccontextmanager
 import logging
 import os
+import time
+from collections import deque
 from dotenv import load_dotenv
+from utils import REPORT_CRITERIA
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,41 +18,127 @@ PG_PORT = os.getenv("PG_PORT")
 PG_DATABASE = os.getenv("PG_DATABASE")
 PG_USER = os.getenv("PG_USER")
 PG_PASSWORD = os.getenv("PG_PASSWORD")
+PG_READ_DSN = os.getenv("PG_READ_DSN")
 
-db_pool = None
+POOL_SIZES = {
+    'interactive': (int(os.getenv("PG_INTERACTIVE_MIN", 2)), int(os.getenv("PG_INTERACTIVE_MAX", 10))),
+    'batch': (int(os.getenv("PG_BATCH_MIN", 2)), int(os.getenv("PG_BATCH_MAX", 20))),
+    'read': (int(os.getenv("PG_READ_MIN", 2)), int(os.getenv("PG_READ_MAX", 10))),
+    'locks': (int(os.getenv("PG_LOCKS_MIN", 1)), int(os.getenv("PG_LOCKS_MAX", 10))),
+}
+LATENCY_WINDOW = 1000
+
+db_pools = {}
+pool_stats = {}
+
+def new_pool_stats():
+    return {
+        'acquire_count': 0,
+        'acquire_wait_total': 0.0,
+        'acquire_wait_max': 0.0,
+        'query_count': 0,
+        'query_errors': 0,
+        'query_time_total': 0.0,
+        'query_time_max': 0.0,
+        'query_times': deque(maxlen=LATENCY_WINDOW),
+    }
+
+def make_query_logger(pool_name):
+    def log_query(record):
+        stats = pool_stats[pool_name]
+        stats['query_count'] += 1
+        stats['query_time_total'] += record.elapsed
+        stats['query_time_max'] = max(stats['query_time_max'], record.elapsed)
+        stats['query_times'].append(record.elapsed)
+        if record.exception is not None:
+            stats['query_errors'] += 1
+    return log_query
+
+def make_pool_init(pool_name):
+    async def init_connection(conn):
+        await json_codec.register_pg_codecs(conn)
+        conn.add_query_logger(make_query_logger(pool_name))
+    return init_connection
+
+async def create_named_pool(pool_name, dsn=None):
+    min_size, max_size = POOL_SIZES[pool_name]
+    pool_stats[pool_name] = new_pool_stats()
+    if dsn:
+        # Явные host/user/... в asyncpg перекрывают DSN, поэтому передаем только его
+        connect_args = {'dsn': dsn}
+    else:
+        connect_args = {
+            'user': PG_USER,
+            'password': PG_PASSWORD,
+            'host': PG_HOST,
+            'port': PG_PORT,
+            'database': PG_DATABASE,
+        }
+    return await asyncpg.create_pool(
+        **connect_args,
+        min_size=min_size,
+        max_size=max_size,
+        timeout=30,
+        init=make_pool_init(pool_name)
+    )
 
 async def create_db_pool():
 
-    global db_pool
-    if db_pool is None:
-        db_pool = await asyncpg.create_pool(
-            user=PG_USER,
-            password=PG_PASSWORD,
-            host=PG_HOST,
-            port=PG_PORT,
-            database=PG_DATABASE,
-            min_size=5,
-            max_size=30,
-            timeout=30
-        )
-        logger.info("Пул соединений БД создан")
-    return db_pool
+    if not db_pools:
+        db_pools['interactive'] = await create_named_pool('interactive')
+        db_pools['batch'] = await create_named_pool('batch')
+        db_pools['locks'] = await create_named_pool('locks')
+        if PG_READ_DSN:
+            db_pools['read'] = await create_named_pool('read', dsn=PG_READ_DSN)
+            logger.info("Пул чтения направлен на реплику")
+        logger.info("Пулы соединений БД созданы")
+    return db_pools['batch']
 
 async def close_db_pool():
 
-    global db_pool
-    if db_pool:
-        await db_pool.close()
-        db_pool = None
-        logger.info("Пул соединений БД закрыт")
+    if db_pools:
+        logger.info(f"Статистика пулов БД: {get_pool_stats()}")
+        for pool in db_pools.values():
+            await pool.close()
+        db_pools.clear()
+        logger.info("Пулы соединений БД закрыты")
+
+def get_pool_stats():
+    result = {}
+    for pool_name, pool in db_pools.items():
+        stats = pool_stats[pool_name]
+        query_times = sorted(stats['query_times'])
+        result[pool_name] = {
+            'size': pool.get_size(),
+            'in_use': pool.get_size() - pool.get_idle_size(),
+            'max_size': pool.get_max_size(),
+            'acquire_count': stats['acquire_count'],
+            'acquire_wait_avg_ms': round(stats['acquire_wait_total'] / stats['acquire_count'] * 1000, 2) if stats['acquire_count'] else 0,
+            'acquire_wait_max_ms': round(stats['acquire_wait_max'] * 1000, 2),
+            'query_count': stats['query_count'],
+            'query_errors': stats['query_errors'],
+            'query_avg_ms': round(stats['query_time_total'] / stats['query_count'] * 1000, 2) if stats['query_count'] else 0,
+            'query_p95_ms': round(query_times[int(len(query_times) * 0.95)] * 1000, 2) if query_times else 0,
+            'query_max_ms': round(stats['query_time_max'] * 1000, 2),
+        }
+    return result
 
 @asynccontextmanager
-async def get_connection():
-    connection = await db_pool.acquire()
+async def get_connection(pool_name='batch'):
+    if pool_name not in db_pools:
+        pool_name = 'interactive'
+    pool = db_pools[pool_name]
+    stats = pool_stats[pool_name]
+    started = time.perf_counter()
+    connection = await pool.acquire()
+    wait = time.perf_counter() - started
+    stats['acquire_count'] += 1
+    stats['acquire_wait_total'] += wait
+    stats['acquire_wait_max'] = max(stats['acquire_wait_max'], wait)
     try:
         yield connection
     finally:
-        await db_pool.release(connection)        
+        await pool.release(connection)        
 
 async def get_chat_from_db():
     async with get_connection() as conn:
@@ -58,58 +148,182 @@ async def get_chat_from_db():
         chats_list = [record['chat_id'] for record in chat_ids]
         return chats_list
     
-async def save_chats_to_db(mapped_chats):
+async def get_chats_for_sync():
     async with get_connection() as conn:
-        inserted_count = 0
 
         query = """
-            INSERT INTO chats (chat_id, title, client_name, created_at, updated_at)
-            VALUES ($1, $2, $3, $4, $5)
-            ON CONFLICT (chat_id)
-            DO UPDATE SET
-                updated_at = EXCLUDED.updated_at
-            WHERE EXCLUDED.updated_at > chats.updated_at
-            RETURNING xmax::text   
+            SELECT chat_id FROM chats
+            WHERE messages_synced_at IS NULL
+                OR updated_at > messages_synced_at;
         """
+        chat_ids = await conn.fetch(query)
+        chats_list = [record['chat_id'] for record in chat_ids]
+        return chats_list
+
+async def mark_chats_synced(chat_ids):
+    async with get_connection() as conn:
+
+        query = """
+            UPDATE chats
+            SET messages_synced_at = updated_at
+            WHERE chat_id = ANY($1::varchar[])
+        """
+        await conn.execute(query, chat_ids)
     
-        for chat in mapped_chats:
-            result = await conn.fetchval(
-                query,
-                chat['chat_id'],
-                chat['title'],
-                chat['client_name'],
-                chat['created_at'],
-                chat['updated_at'],
+async def save_chats_to_db(mapped_chats):
+    async with get_connection() as conn:
+        async with conn.transaction():
+
+            await conn.execute("""
+                CREATE TEMP TABLE chats_staging
+                    (LIKE chats INCLUDING DEFAULTS)
+                ON COMMIT DROP
+            """)
+
+            records = [
+                (
+                    chat['chat_id'],
+                    chat['title'],
+                    chat['client_name'],
+                    chat['created_at'],
+                    chat['updated_at'],
+                )
+                for chat in mapped_chats
+            ]
+            await conn.copy_records_to_table(
+                'chats_staging',
+                records=records,
+                columns=['chat_id', 'title', 'client_name', 'created_at', 'updated_at'],
             )
-            if result == '0':
-                inserted_count += 1
 
-        logger.info(f"В БД добавлено: {inserted_count} чатов")
+            query = """
+                INSERT INTO chats (chat_id, title, client_name, created_at, updated_at)
+                SELECT DISTINCT ON (chat_id)
+                    chat_id, title, client_name, created_at, updated_at
+                FROM chats_staging
+                ORDER BY chat_id, updated_at DESC
+                ON CONFLICT (chat_id)
+                DO UPDATE SET
+                    title = COALESCE(chats.title, EXCLUDED.title),
+                    client_name = COALESCE(chats.client_name, EXCLUDED.client_name),
+                    updated_at = GREATEST(chats.updated_at, EXCLUDED.updated_at)
+                WHERE EXCLUDED.updated_at > chats.updated_at
+                    OR chats.title IS NULL
+                RETURNING xmax::text
+            """
+            results = await conn.fetch(query)
+
+        inserted_count = sum(1 for record in results if record['xmax'] == '0')
+        updated_count = len(results) - inserted_count
+
+        logger.info(f"В БД добавлено: {inserted_count} чатов, обновлено: {updated_count}")
+        return inserted_count + updated_count
     
+async def get_known_message_ids(message_ids):
+    async with get_connection() as conn:
+
+        query = "SELECT message_id FROM messages WHERE message_id = ANY($1::varchar[])"
+        records = await conn.fetch(query, message_ids)
+        return {record['message_id'] for record in records}
+
 async def save_messages_to_db(messages_list):
     async with get_connection() as conn:
+        async with conn.transaction():
+
+            await conn.execute("""
+                CREATE TEMP TABLE messages_staging
+                    (LIKE messages INCLUDING DEFAULTS)
+                ON COMMIT DROP
+            """)
+
+            records = [
+                (
+                    msg['message_id'],
+                    msg['chat_id'],
+                    msg['text'],
+                    msg['is_from_company'],
+                    msg['created_at'],
+                )
+                for msg in messages_list
+            ]
+            await conn.copy_records_to_table(
+                'messages_staging',
+                records=records,
+                columns=['message_id', 'chat_id', 'text', 'is_from_company', 'created_at'],
+            )
+
+            query = """
+                WITH inserted AS (
+                    INSERT INTO messages 
+                        (message_id, chat_id, text, is_from_company, created_at)
+                    SELECT DISTINCT ON (message_id)
+                        message_id, chat_id, text, is_from_company, created_at
+                    FROM messages_staging
+                    ON CONFLICT (message_id, created_at) 
+                    DO NOTHING
+                    RETURNING 1
+                )
+                SELECT COUNT(*) FROM inserted
+            """
+            inserted_count = await conn.fetchval(query)
+
+        return inserted_count
     
-        query = """
-            INSERT INTO messages 
-                (message_id, chat_id, text, is_from_company, created_at)
-            VALUES 
-                ($1, $2, $3, $4, $5)
-            ON CONFLICT (message_id) 
-            DO NOTHING
-        """
-        
-        records = []
-        for msg in messages_list:
-            records.append((
-                msg['message_id'],
-                msg['chat_id'],
-                msg['text'],
-                msg['is_from_company'],
-                msg['created_at'],
-            ))
-        
-        await conn.executemany(query, records)
+async def save_webhook_message_to_db(message):
+    async with get_connection('interactive') as conn:
+        async with conn.transaction():
+
+            chat_query = """
+                INSERT INTO chats (chat_id, created_at, updated_at)
+                VALUES ($1, $2, $2)
+                ON CONFLICT (chat_id)
+                DO UPDATE SET
+                    updated_at = EXCLUDED.updated_at
+                WHERE EXCLUDED.updated_at > chats.updated_at
+            """
+
+            message_query = """
+                INSERT INTO messages 
+                    (message_id, chat_id, text, is_from_company, created_at)
+                VALUES 
+                    ($1, $2, $3, $4, $5)
+                ON CONFLICT (message_id, created_at) 
+                DO NOTHING
+            """
+
+            await conn.execute(chat_query, message['chat_id'], message['created_at'])
+            await conn.execute(
+                message_query,
+                message['message_id'],
+                message['chat_id'],
+                message['text'],
+                message['is_from_company'],
+                message['created_at'],
+            )
     
+async def update_report_daily_stats(conn, old_report, report_day, mapped_data):
+    query = """
+        INSERT INTO report_daily_stats (day, criterion, grade, report_count)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (day, criterion, grade)
+        DO UPDATE SET
+            report_count = report_daily_stats.report_count + EXCLUDED.report_count
+    """
+
+    deltas = {}
+    for criterion in REPORT_CRITERIA:
+        grade_key = f'{criterion}_grade'
+        if old_report:
+            key = (old_report['day'], criterion, old_report[grade_key] or '')
+            deltas[key] = deltas.get(key, 0) - 1
+        key = (report_day, criterion, mapped_data[grade_key] or '')
+        deltas[key] = deltas.get(key, 0) + 1
+
+    # Строки блокируются в одном порядке во всех транзакциях, чтобы параллельные сохранения не ловили deadlock
+    records = [(*key, delta) for key, delta in sorted(deltas.items()) if delta]
+    if records:
+        await conn.executemany(query, records)
+
 async def save_reports_to_db(mapped_data):
          async with get_connection() as conn:
              
@@ -119,8 +333,11 @@ async def save_reports_to_db(mapped_data):
                     total_messages, company_messages, client_messages, tonality_grade, tonality_comment, 
                     professionalism_grade, professionalism_comment, clarity_grade, clarity_comment, 
                     problem_solving_grade, problem_solving_comment, objection_handling_grade, 
-                    objection_handling_comment, closure_grade, closure_comment, summary, recommendations)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18, $19, $20, $21, $22, $23)
+                    objection_handling_comment, closure_grade, closure_comment, summary, recommendations,
+                    dialog_hash, prompt_version, checked_at, analysis_mode, incremental_runs, full_analyzed_at,
+                    dialog_tokens, trimmed_tokens, trimmed_messages, deduplicated_messages, analyzed_until)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18, $19, $20, $21, $22, $23,
+                    $24, $25, $2, $26, $27, $28, $29, $30, $31, $32, $33)
                 ON CONFLICT (chat_id)
                 DO UPDATE SET
                     chat_title = EXCLUDED.chat_title,
@@ -144,39 +361,97 @@ async def save_reports_to_db(mapped_data):
                     closure_grade = EXCLUDED.closure_grade,
                     closure_comment = EXCLUDED.closure_comment,
                     summary = EXCLUDED.summary,
-                    recommendations = EXCLUDED.recommendations
+                    recommendations = EXCLUDED.recommendations,
+                    dialog_hash = EXCLUDED.dialog_hash,
+                    prompt_version = EXCLUDED.prompt_version,
+                    checked_at = EXCLUDED.checked_at,
+                    analysis_mode = EXCLUDED.analysis_mode,
+                    incremental_runs = EXCLUDED.incremental_runs,
+                    full_analyzed_at = EXCLUDED.full_analyzed_at,
+                    dialog_tokens = EXCLUDED.dialog_tokens,
+                    trimmed_tokens = EXCLUDED.trimmed_tokens,
+                    trimmed_messages = EXCLUDED.trimmed_messages,
+                    deduplicated_messages = EXCLUDED.deduplicated_messages,
+                    analyzed_until = EXCLUDED.analyzed_until
                 WHERE EXCLUDED.created_at > chat_reports.created_at
+                RETURNING created_at::date
             """
 
-            await conn.execute(
-                query,
-                mapped_data['chat_id'],
-                mapped_data['created_at'],
-                mapped_data['chat_title'],
-                mapped_data['client_name'],
-                mapped_data['chat_created_at'],
-                mapped_data['chat_updated_at'],
-                mapped_data['total_messages'],
-                mapped_data['company_messages'],
-                mapped_data['client_messages'],
-                mapped_data['tonality_grade'],
-                mapped_data['tonality_comment'],
-                mapped_data['professionalism_grade'],
-                mapped_data['professionalism_comment'],
-                mapped_data['clarity_grade'],
-                mapped_data['clarity_comment'],
-                mapped_data['problem_solving_grade'],
-                mapped_data['problem_solving_comment'],
-                mapped_data['objection_handling_grade'],
-                mapped_data['objection_handling_comment'],
-                mapped_data['closure_grade'],
-                mapped_data['closure_comment'],
-                mapped_data['summary'],
-                mapped_data['recommendations']
-            )
+            old_report_query = """
+                SELECT created_at::date AS day, tonality_grade, professionalism_grade, clarity_grade,
+                    problem_solving_grade, objection_handling_grade, closure_grade
+                FROM chat_reports
+                WHERE chat_id = $1
+                FOR UPDATE
+            """
 
-async def get_reports_from_db(start_date, end_date):
+            async with conn.transaction():
+                old_report = await conn.fetchrow(old_report_query, mapped_data['chat_id'])
+                report_day = await conn.fetchval(
+                    query,
+                    mapped_data['chat_id'],
+                    mapped_data['created_at'],
+                    mapped_data['chat_title'],
+                    mapped_data['client_name'],
+                    mapped_data['chat_created_at'],
+                    mapped_data['chat_updated_at'],
+                    mapped_data['total_messages'],
+                    mapped_data['company_messages'],
+                    mapped_data['client_messages'],
+                    mapped_data['tonality_grade'],
+                    mapped_data['tonality_comment'],
+                    mapped_data['professionalism_grade'],
+                    mapped_data['professionalism_comment'],
+                    mapped_data['clarity_grade'],
+                    mapped_data['clarity_comment'],
+                    mapped_data['problem_solving_grade'],
+                    mapped_data['problem_solving_comment'],
+                    mapped_data['objection_handling_grade'],
+                    mapped_data['objection_handling_comment'],
+                    mapped_data['closure_grade'],
+                    mapped_data['closure_comment'],
+                    mapped_data['summary'],
+                    mapped_data['recommendations'],
+                    mapped_data['dialog_hash'],
+                    mapped_data['prompt_version'],
+                    mapped_data['analysis_mode'],
+                    mapped_data['incremental_runs'],
+                    mapped_data['full_analyzed_at'],
+                    mapped_data['dialog_tokens'],
+                    mapped_data['trimmed_tokens'],
+                    mapped_data['trimmed_messages'],
+                    mapped_data['deduplicated_messages'],
+                    mapped_data['analyzed_until']
+                )
+
+                if report_day is not None:
+                    await update_report_daily_stats(conn, old_report, report_day, mapped_data)
+
+async def mark_report_checked(chat_id, checked_at):
+    async with get_connection() as conn:
+
+        query = "UPDATE chat_reports SET checked_at = $2 WHERE chat_id = $1"
+        await conn.execute(query, chat_id, checked_at)
+
+async def save_llm_usage(run_id, chat_ids, analysis_mode, usage):
     async with get_connection() as conn:
+
+        query = """
+            INSERT INTO llm_usage (run_id, chat_ids, analysis_mode, prompt_tokens, completion_tokens, cached_tokens)
+            VALUES ($1, $2, $3, $4, $5, $6)
+        """
+        await conn.execute(
+            query,
+            run_id,
+            chat_ids,
+            analysis_mode,
+            usage['prompt_tokens'],
+            usage['completion_tokens'],
+            usage['cached_tokens']
+        )
+
+async def get_reports_from_db(start_date, end_date):
+    async with get_connection('read') as conn:
        
             query = """
                 SELECT * FROM chat_reports 
@@ -192,6 +467,95 @@ async def get_reports_from_db(start_date, end_date):
                 
             return reports       
 
+async def count_reports_in_period(start_date, end_date):
+    async with get_connection('read') as conn:
+
+        query = "SELECT COUNT(*) FROM chat_reports WHERE created_at BETWEEN $1 AND $2"
+        return await conn.fetchval(query, start_date, end_date)
+
+async def get_reports_page(start_date, end_date, cursor=None, limit=1):
+    async with get_connection('read') as conn:
+
+        if cursor is None:
+            query = """
+                SELECT * FROM chat_reports 
+                WHERE created_at BETWEEN $1 AND $2 
+                ORDER BY created_at DESC, chat_id DESC
+                LIMIT $3
+            """
+            records = await conn.fetch(query, start_date, end_date, limit)
+        else:
+            query = """
+                SELECT * FROM chat_reports 
+                WHERE created_at BETWEEN $1 AND $2 
+                    AND (created_at, chat_id) < ($3, $4)
+                ORDER BY created_at DESC, chat_id DESC
+                LIMIT $5
+            """
+            records = await conn.fetch(
+                query, start_date, end_date, cursor['created_at'], cursor['chat_id'], limit
+            )
+
+        return [dict(record) for record in records]
+
+async def get_report_stats(start_day, end_day):
+    async with get_connection('read') as conn:
+
+        query = """
+            SELECT criterion, grade, SUM(report_count) AS report_count
+            FROM report_daily_stats
+            WHERE day BETWEEN $1 AND $2
+            GROUP BY criterion, grade
+            HAVING SUM(report_count) > 0
+            ORDER BY criterion, report_count DESC
+        """
+        records = await conn.fetch(query, start_day, end_day)
+        return [dict(record) for record in records]
+
+async def search_dialogs(search_text, limit=5, offset=0):
+    async with get_connection('read') as conn:
+
+        query = """
+            WITH search AS (
+                SELECT websearch_to_tsquery('russian', $1) AS query
+            ),
+            hits AS (
+                SELECT messages.chat_id, messages.text AS found_text, 'message' AS source,
+                    ts_rank(messages.text_tsv, search.query) AS rank
+                FROM messages, search
+                WHERE messages.text_tsv @@ search.query
+                UNION ALL
+                SELECT chat_reports.chat_id, concat_ws(' ', chat_reports.summary, chat_reports.recommendations),
+                    'report', ts_rank(chat_reports.report_tsv, search.query) * 2
+                FROM chat_reports, search
+                WHERE chat_reports.report_tsv @@ search.query
+            ),
+            best_hits AS (
+                SELECT DISTINCT ON (chat_id) chat_id, found_text, source, rank
+                FROM hits
+                ORDER BY chat_id, rank DESC
+            )
+            SELECT
+                chats.chat_id,
+                chats.title,
+                chats.client_name,
+                chats.updated_at,
+                best_hits.source,
+                best_hits.rank,
+                ts_headline(
+                    'russian', best_hits.found_text, search.query,
+                    'StartSel=«, StopSel=», MaxWords=25, MinWords=8, MaxFragments=1'
+                ) AS snippet,
+                COUNT(*) OVER () AS total_count
+            FROM best_hits
+            JOIN chats ON chats.chat_id = best_hits.chat_id
+            CROSS JOIN search
+            ORDER BY best_hits.rank DESC, chats.chat_id
+            LIMIT $2 OFFSET $3
+        """
+        records = await conn.fetch(query, search_text, limit, offset)
+        return [dict(record) for record in records]
+
 async def get_chats_for_analysis():
     async with get_connection() as conn:
 
@@ -205,7 +569,7 @@ async def get_chats_for_analysis():
             WHERE 
                 chat_reports.chat_id IS NULL 
                 OR 
-                chats.updated_at > chat_reports.created_at
+                chats.updated_at > COALESCE(chat_reports.checked_at, chat_reports.created_at)
             ORDER BY 
                 chats.updated_at DESC;
         """
@@ -219,7 +583,7 @@ async def get_chats_for_analysis():
 
         return chat_ids_for_analysis
     
-async def get_chat_data_for_analysis(chat_id):
+async def get_chats_data_for_analysis(chat_ids):
     async with get_connection() as conn:
 
         query = """
@@ -229,41 +593,89 @@ async def get_chat_data_for_analysis(chat_id):
                 chats.client_name,
                 chats.created_at,
                 chats.updated_at,
-                json_agg(
-                    json_build_object(
-                        'text', messages.text,
-                        'is_from_company', messages.is_from_company,
-                        'created_at', messages.created_at
-                    ) ORDER BY messages.created_at ASC
-                ) as messages,
-            COUNT(messages.message_id) as total_messages,
-            COUNT(messages.message_id) FILTER (WHERE messages.is_from_company = true) as company_messages,
-            COUNT(messages.message_id) FILTER (WHERE messages.is_from_company = false) as client_messages    
+                chat_reports.chat_id IS NOT NULL AS has_report,
+                chat_reports.created_at AS report_created_at,
+                chat_reports.dialog_hash,
+                chat_reports.prompt_version,
+                chat_reports.incremental_runs,
+                chat_reports.full_analyzed_at,
+                EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - chat_reports.full_analyzed_at) / 86400 AS full_analysis_age_days,
+                chat_reports.tonality_grade, chat_reports.tonality_comment,
+                chat_reports.professionalism_grade, chat_reports.professionalism_comment,
+                chat_reports.clarity_grade, chat_reports.clarity_comment,
+                chat_reports.problem_solving_grade, chat_reports.problem_solving_comment,
+                chat_reports.objection_handling_grade, chat_reports.objection_handling_comment,
+                chat_reports.closure_grade, chat_reports.closure_comment,
+                chat_reports.summary,
+                chat_reports.recommendations,
+                chat_messages.messages,
+                chat_messages.total_messages,
+                chat_messages.company_messages,
+                chat_messages.client_messages,
+                chat_messages.new_messages,
+                chat_messages.last_message_at
             FROM chats
-            LEFT JOIN messages ON chats.chat_id = messages.chat_id
-            WHERE chats.chat_id = $1
-            GROUP BY chats.chat_id, chats.title, chats.client_name, chats.created_at, chats.updated_at
+            LEFT JOIN chat_reports ON chats.chat_id = chat_reports.chat_id
+            LEFT JOIN LATERAL (
+                SELECT
+                    json_agg(
+                        json_build_object(
+                            'text', messages.text,
+                            'is_from_company', messages.is_from_company,
+                            'created_at', messages.created_at,
+                            'is_new', messages.created_at > COALESCE(chat_reports.analyzed_until, chat_reports.created_at)
+                        ) ORDER BY messages.created_at ASC
+                    ) as messages,
+                    MAX(messages.created_at) as last_message_at,
+                    COUNT(messages.message_id) as total_messages,
+                    COUNT(messages.message_id) FILTER (WHERE messages.is_from_company = true) as company_messages,
+                    COUNT(messages.message_id) FILTER (WHERE messages.is_from_company = false) as client_messages,
+                    COUNT(messages.message_id) FILTER (WHERE messages.created_at > COALESCE(chat_reports.analyzed_until, chat_reports.created_at)) as new_messages
+                FROM messages
+                WHERE messages.chat_id = chats.chat_id
+            ) chat_messages ON true
+            WHERE chats.chat_id = ANY($1::varchar[])
         """
-        record = await conn.fetchrow(query, chat_id)
-
-        messages = json.loads(record['messages']) if record['messages'] else []
-
-        chat_data = {
-            'chat_id': record['chat_id'],
-            'chat_title': record['title'],
-            'chat_client_name': record['client_name'],
-            'chat_created_at': record['created_at'],
-            'chat_updated_at': record['updated_at'],
-            'messages': messages,
-            'total_messages': record['total_messages'] or 0,
-            'company_messages': record['company_messages'] or 0,
-            'client_messages': record['client_messages'] or 0
-        }
+        records = await conn.fetch(query, chat_ids)
+
+        chats_data = []
+        for record in records:
+            previous_report = None
+            if record['has_report']:
+                previous_report = {
+                    'created_at': record['report_created_at'],
+                    'incremental_runs': record['incremental_runs'],
+                    'full_analyzed_at': record['full_analyzed_at'],
+                    'full_analysis_age_days': float(record['full_analysis_age_days'] or 0),
+                    'summary': record['summary'],
+                    'recommendations': record['recommendations'],
+                }
+                for criterion in REPORT_CRITERIA:
+                    previous_report[f'{criterion}_grade'] = record[f'{criterion}_grade']
+                    previous_report[f'{criterion}_comment'] = record[f'{criterion}_comment']
+
+            chat_data = {
+                'chat_id': record['chat_id'],
+                'chat_title': record['title'],
+                'chat_client_name': record['client_name'],
+                'chat_created_at': record['created_at'],
+                'chat_updated_at': record['updated_at'],
+                'messages': record['messages'] or [],
+                'total_messages': record['total_messages'] or 0,
+                'company_messages': record['company_messages'] or 0,
+                'client_messages': record['client_messages'] or 0,
+                'new_messages': record['new_messages'] or 0,
+                'last_message_at': record['last_message_at'],
+                'report_dialog_hash': record['dialog_hash'],
+                'report_prompt_version': record['prompt_version'],
+                'previous_report': previous_report
+            }
+            chats_data.append(chat_data)
         
-        return chat_data
+        return chats_data
 
 async def add_user_to_db(user_data):
-    async with get_connection() as conn:
+    async with get_connection('interactive') as conn:
 
         query = """
             INSERT INTO users (user_id, username, first_name, last_name)
@@ -284,8 +696,210 @@ async def add_user_to_db(user_data):
         )
 
 async def get_all_active_users():
-    async with get_connection() as conn:
+    async with get_connection('read') as conn:
         query = "SELECT user_id FROM users WHERE is_active = TRUE"
         records = await conn.fetch(query)
         user_ids = [record['user_id'] for record in records]
-        return user_ids
\ No newline at end of file
+        return user_ids
+
+async def get_api_token(name):
+    async with get_connection() as conn:
+        query = "SELECT access_token, expires_at FROM api_tokens WHERE name = $1"
+        record = await conn.fetchrow(query, name)
+        return dict(record) if record else None
+
+async def save_api_token(name, access_token, expires_at):
+    async with get_connection() as conn:
+
+        query = """
+            INSERT INTO api_tokens (name, access_token, expires_at, updated_at)
+            VALUES ($1, $2, $3, CURRENT_TIMESTAMP)
+            ON CONFLICT (name)
+            DO UPDATE SET
+                access_token = EXCLUDED.access_token,
+                expires_at = EXCLUDED.expires_at,
+                updated_at = EXCLUDED.updated_at
+        """
+
+        await conn.execute(query, name, access_token, expires_at)
+
+@asynccontextmanager
+async def fsm_event_lock(storage_key):
+    # Отдельный пул: соединение с блокировкой удерживается на все время обработки события,
+    # а обработчик сам берет соединения из interactive
+    async with get_connection('locks') as conn:
+        await conn.execute("SELECT pg_advisory_lock(hashtextextended($1, 0))", storage_key)
+        try:
+            yield
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtextextended($1, 0))", storage_key)
+
+async def get_fsm_state(key, ttl):
+    async with get_connection('interactive') as conn:
+
+        query = """
+            SELECT state FROM fsm_storage
+            WHERE key = $1 AND updated_at > CURRENT_TIMESTAMP - $2::interval
+        """
+        return await conn.fetchval(query, key, ttl)
+
+async def set_fsm_state(key, state, ttl):
+    async with get_connection('interactive') as conn:
+
+        query = """
+            INSERT INTO fsm_storage (key, state, updated_at)
+            VALUES ($1, $2, CURRENT_TIMESTAMP)
+            ON CONFLICT (key)
+            DO UPDATE SET
+                state = EXCLUDED.state,
+                data = CASE
+                    WHEN fsm_storage.updated_at > CURRENT_TIMESTAMP - $3::interval
+                    THEN fsm_storage.data
+                    ELSE EXCLUDED.data
+                END,
+                updated_at = EXCLUDED.updated_at
+        """
+        await conn.execute(query, key, state, ttl)
+
+async def get_fsm_data(key, ttl):
+    async with get_connection('interactive') as conn:
+
+        query = """
+            SELECT data FROM fsm_storage
+            WHERE key = $1 AND updated_at > CURRENT_TIMESTAMP - $2::interval
+        """
+        data = await conn.fetchval(query, key, ttl)
+        return data or {}
+
+async def set_fsm_data(key, data, ttl):
+    async with get_connection('interactive') as conn:
+
+        query = """
+            INSERT INTO fsm_storage (key, data, updated_at)
+            VALUES ($1, $2::jsonb, CURRENT_TIMESTAMP)
+            ON CONFLICT (key)
+            DO UPDATE SET
+                state = CASE
+                    WHEN fsm_storage.updated_at > CURRENT_TIMESTAMP - $3::interval
+                    THEN fsm_storage.state
+                END,
+                data = EXCLUDED.data,
+                updated_at = EXCLUDED.updated_at
+        """
+        await conn.execute(query, key, data, ttl)
+
+async def update_fsm_data(key, data, ttl):
+    async with get_connection('interactive') as conn:
+
+        query = """
+            INSERT INTO fsm_storage (key, data, updated_at)
+            VALUES ($1, $2::jsonb, CURRENT_TIMESTAMP)
+            ON CONFLICT (key)
+            DO UPDATE SET
+                state = CASE
+                    WHEN fsm_storage.updated_at > CURRENT_TIMESTAMP - $3::interval
+                    THEN fsm_storage.state
+                END,
+                data = CASE
+                    WHEN fsm_storage.updated_at > CURRENT_TIMESTAMP - $3::interval
+                    THEN fsm_storage.data || EXCLUDED.data
+                    ELSE EXCLUDED.data
+                END,
+                updated_at = EXCLUDED.updated_at
+            RETURNING data
+        """
+        return await conn.fetchval(query, key, data, ttl)
+
+async def delete_expired_fsm_sessions(ttl):
+    async with get_connection('interactive') as conn:
+
+        query = """
+            DELETE FROM fsm_storage
+            WHERE updated_at < CURRENT_TIMESTAMP - $1::interval
+                OR (state IS NULL AND data = '{}'::jsonb)
+        """
+        result = await conn.execute(query, ttl)
+        logger.info(f"Удалено устаревших FSM-сессий: {result.split()[-1]}")
+
+async def ensure_message_partitions(months_ahead):
+    async with get_connection() as conn:
+
+        query = """
+            SELECT create_messages_partition(
+                (date_trunc('month', CURRENT_TIMESTAMP) + month_offset * interval '1 month')::date
+            )
+            FROM generate_series(0, $1::int) AS month_offset
+        """
+        records = await conn.fetch(query, months_ahead)
+        return [record[0] for record in records]
+
+async def get_message_partitions():
+    async with get_connection() as conn:
+
+        query = """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = 'messages'::regclass
+            ORDER BY child.relname
+        """
+        records = await conn.fetch(query)
+        return [record['relname'] for record in records]
+
+ARCHIVE_WATERMARK_QUERY = """
+    INSERT INTO message_archive_watermark (id, archived_before, updated_at)
+    VALUES (TRUE, $1, CURRENT_TIMESTAMP)
+    ON CONFLICT (id)
+    DO UPDATE SET
+        archived_before = GREATEST(message_archive_watermark.archived_before, EXCLUDED.archived_before),
+        updated_at = EXCLUDED.updated_at
+"""
+
+async def archive_message_partition(partition_name, archive_path):
+    async with get_connection() as conn:
+
+        partial_path = f"{archive_path}.part"
+        with gzip.open(partial_path, 'wb') as archive_file:
+            await conn.copy_from_table(partition_name, output=archive_file, format='csv', header=True)
+        os.replace(partial_path, archive_path)
+
+        async with conn.transaction():
+            archived_before = await conn.fetchval(
+                "SELECT to_timestamp(right($1, 7), 'YYYY_MM') + interval '1 month'", partition_name
+            )
+            await conn.execute(f'ALTER TABLE messages DETACH PARTITION "{partition_name}"')
+            await conn.execute(f'DROP TABLE "{partition_name}"')
+            await conn.execute(ARCHIVE_WATERMARK_QUERY, archived_before)
+
+async def archive_default_messages(cutoff_name, archive_path):
+    async with get_connection() as conn:
+
+        # В REPEATABLE READ удаляются ровно те строки, что попали в архив
+        async with conn.transaction(isolation='repeatable_read'):
+            cutoff = await conn.fetchval("SELECT to_timestamp(right($1, 7), 'YYYY_MM')", cutoff_name)
+            count = await conn.fetchval("SELECT COUNT(*) FROM messages_default WHERE created_at < $1", cutoff)
+
+            if count:
+                partial_path = f"{archive_path}.part"
+                with gzip.open(partial_path, 'wb') as archive_file:
+                    await conn.copy_from_query(
+                        """
+                            SELECT message_id, chat_id, text, is_from_company, created_at
+                            FROM messages_default
+                            WHERE created_at < $1
+                        """,
+                        cutoff,
+                        output=archive_file,
+                        format='csv',
+                        header=True,
+                    )
+                os.replace(partial_path, archive_path)
+                await conn.execute("DELETE FROM messages_default WHERE created_at < $1", cutoff)
+
+            await conn.execute(ARCHIVE_WATERMARK_QUERY, cutoff)
+            return count
+
+async def get_messages_archived_before():
+    async with get_connection() as conn:
+        query = "SELECT archived_before FROM message_archive_watermark"
+        return await conn.fetchval(query)
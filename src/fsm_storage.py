@@ -0,0 +1,46 @@
+import os
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from dotenv import load_dotenv
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage, DefaultKeyBuilder
+import database
+
+load_dotenv()
+FSM_TTL = timedelta(hours=float(os.getenv("FSM_TTL_HOURS", 24)))
+
+class PostgresStorage(BaseStorage):
+    def __init__(self, ttl=FSM_TTL, key_builder=None):
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        await database.set_fsm_state(self.key_builder.build(key), state, self.ttl)
+
+    async def get_state(self, key):
+        return await database.get_fsm_state(self.key_builder.build(key), self.ttl)
+
+    async def set_data(self, key, data):
+        await database.set_fsm_data(self.key_builder.build(key), dict(data), self.ttl)
+
+    async def get_data(self, key):
+        return await database.get_fsm_data(self.key_builder.build(key), self.ttl)
+
+    async def update_data(self, key, data):
+        return await database.update_fsm_data(self.key_builder.build(key), dict(data), self.ttl)
+
+    async def close(self):
+        pass
+
+class PostgresEventIsolation(BaseEventIsolation):
+    def __init__(self, key_builder=None):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+
+    @asynccontextmanager
+    async def lock(self, key):
+        async with database.fsm_event_lock(self.key_builder.build(key)):
+            yield
+
+    async def close(self):
+        pass
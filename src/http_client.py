@@ -0,0 +1,54 @@
+import aiohttp
+import logging
+import os
+import json_codec
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+HTTP_LIMIT = int(os.getenv("HTTP_LIMIT", 100))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", 20))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", 300))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 30))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+
+http_session = None
+
+async def create_http_session():
+
+    global http_session
+    if http_session is None:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_LIMIT,
+            limit_per_host=HTTP_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_TTL,
+            use_dns_cache=True,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=HTTP_TIMEOUT,
+            sock_connect=HTTP_CONNECT_TIMEOUT,
+        )
+        http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            json_serialize=json_codec.dumps,
+        )
+        logger.info(f"HTTP-сессия создана (JSON: {json_codec.CODEC_NAME})")
+    return http_session
+
+async def close_http_session():
+
+    global http_session
+    if http_session:
+        await http_session.close()
+        http_session = None
+        logger.info("HTTP-сессия закрыта")
+
+def get_http_session():
+    if http_session is None:
+        raise RuntimeError("HTTP-сессия не создана, вызовите create_http_session()")
+    return http_session
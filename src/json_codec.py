@@ -0,0 +1,36 @@
+import json
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    CODEC_NAME = "orjson"
+else:
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False)
+
+    CODEC_NAME = "json"
+
+async def register_pg_codecs(conn):
+    for type_name in ('json', 'jsonb'):
+        await conn.set_type_codec(
+            type_name,
+            encoder=dumps,
+            decoder=loads,
+            schema='pg_catalog',
+        )
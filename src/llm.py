@@ -1,11 +1,41 @@
+import asyncio
 import os
 import aiohttp
-import json
+import json_codec
 from dotenv import load_dotenv
-from retry_config import api_retry
+from retry_config import api_retry, raise_for_retryable, RetryableHTTPError
+import rate_limit
+from http_client import get_http_session
 
 load_dotenv()
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", 2000))
+DEEPSEEK_MAX_OUTPUT_TOKENS = 8192
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", 2))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 50))
+LLM_INITIAL_CONCURRENCY = int(os.getenv("LLM_INITIAL_CONCURRENCY", 10))
+LLM_LATENCY_TARGET = float(os.getenv("LLM_LATENCY_TARGET", 30))
+
+llm_limiter = rate_limit.AdaptiveLimiter(
+    "deepseek",
+    min_limit=LLM_MIN_CONCURRENCY,
+    max_limit=LLM_MAX_CONCURRENCY,
+    initial_limit=LLM_INITIAL_CONCURRENCY,
+    latency_target=LLM_LATENCY_TARGET,
+    overload_errors=(RetryableHTTPError, asyncio.TimeoutError),
+)
+
+def parse_usage(usage):
+    usage = usage or {}
+    cached_tokens = usage.get('prompt_cache_hit_tokens')
+    if cached_tokens is None:
+        cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0)
+    return {
+        'prompt_tokens': usage.get('prompt_tokens', 0),
+        'completion_tokens': usage.get('completion_tokens', 0),
+        'cached_tokens': cached_tokens or 0,
+    }
 
 @api_retry
 async def send_to_deepseek(prompt_data):
@@ -20,15 +50,20 @@ async def send_to_deepseek(prompt_data):
             {"role": "user", "content": prompt_data["user"]}
         ],
         "temperature": 0.1,
+        "max_tokens": min(LLM_MAX_TOKENS * prompt_data.get("report_count", 1), DEEPSEEK_MAX_OUTPUT_TOKENS),
         "response_format": { "type": "json_object" }
     }
-    async with aiohttp.ClientSession() as session:
+    url = "https://api.deepseek.com/v1/chat/completions"
+    async with llm_limiter.slot():
+        await rate_limit.acquire(url)
+        session = get_http_session()
         async with session.post(
-            "https://api.deepseek.com/v1/chat/completions", 
+            url, 
             headers=headers, 
             json=payload,
-            timeout=60
+            timeout=aiohttp.ClientTimeout(total=LLM_TIMEOUT)
         ) as response:  
-            result = await response.json()
-            content_json = result['choices'][0]['message']['content']
-            return json.loads(content_json)
\ No newline at end of file
+            raise_for_retryable(response)
+            result = await response.json(loads=json_codec.loads)
+    content_json = result['choices'][0]['message']['content']
+    return json_codec.loads(content_json), parse_usage(result.get('usage'))
\ No newline at end of file
@@ -1,18 +1,23 @@
 import os
+import re
+import html
 import logging
 import argparse
 import asyncio
 import random
+import uuid
 import database
+import http_client
 import avito
 import utils
 import llm
+import fsm_storage
 from datetime import datetime, timedelta, timezone
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 
@@ -22,16 +27,53 @@ class ReportState(StatesGroup):
     waiting_for_end_date = State()
     showing_reports = State()
 
+class SearchState(StatesGroup):
+    waiting_for_query = State()
+    showing_results = State()
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 USER_ID = os.getenv("AVITO_USER_ID")
+AVITO_SYNC_WORKERS = int(os.getenv("AVITO_SYNC_WORKERS", 10))
+AVITO_QUEUE_SIZE = int(os.getenv("AVITO_QUEUE_SIZE", 50))
+AVITO_WRITE_BATCH = int(os.getenv("AVITO_WRITE_BATCH", 1000))
+AVITO_FLUSH_INTERVAL = float(os.getenv("AVITO_FLUSH_INTERVAL", 5))
+AVITO_WEBHOOK_ENABLED = bool(os.getenv("AVITO_WEBHOOK_URL"))
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", 50))
+LLM_INCREMENTAL_MIN_MESSAGES = int(os.getenv("LLM_INCREMENTAL_MIN_MESSAGES", 30))
+LLM_INCREMENTAL_MAX_NEW_MESSAGES = int(os.getenv("LLM_INCREMENTAL_MAX_NEW_MESSAGES", 50))
+LLM_FULL_REANALYSIS_RUNS = int(os.getenv("LLM_FULL_REANALYSIS_RUNS", 5))
+LLM_FULL_REANALYSIS_DAYS = float(os.getenv("LLM_FULL_REANALYSIS_DAYS", 30))
+LLM_DIALOG_TOKEN_BUDGET = int(os.getenv("LLM_DIALOG_TOKEN_BUDGET", 8000))
+LLM_PACK_MAX_CHATS = int(os.getenv("LLM_PACK_MAX_CHATS", 4))
+LLM_PACK_CHAT_TOKENS = int(os.getenv("LLM_PACK_CHAT_TOKENS", 800))
+LLM_PACK_TOKEN_BUDGET = int(os.getenv("LLM_PACK_TOKEN_BUDGET", 3000))
+FSM_STORAGE = os.getenv("FSM_STORAGE", "postgres")
+MESSAGES_PARTITIONS_AHEAD = int(os.getenv("MESSAGES_PARTITIONS_AHEAD", 3))
+MESSAGES_RETENTION_MONTHS = int(os.getenv("MESSAGES_RETENTION_MONTHS", 0))
+MESSAGES_ARCHIVE_DIR = os.getenv("MESSAGES_ARCHIVE_DIR", "archive")
+
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 5))
+
+STATS_PERIODS = {
+    "stats_week": 7,
+    "stats_month": 30,
+    "stats_quarter": 91,
+    "stats_year": 365,
+}
 
 moscow_tz = timezone(timedelta(hours=3))
 bot = Bot(token=TOKEN)
-dp = Dispatcher()
+if FSM_STORAGE == "postgres":
+    dp = Dispatcher(
+        storage=fsm_storage.PostgresStorage(),
+        events_isolation=fsm_storage.PostgresEventIsolation(),
+    )
+else:
+    dp = Dispatcher()
 
 def get_period_selection_keyboard():
     keyboard = [
@@ -63,6 +105,30 @@ def get_reports_navigation_keyboard(current_index, total_reports, has_next):
     ])
     return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+def get_search_navigation_keyboard(has_next):
+    keyboard = []
+    if has_next:
+        keyboard.append([
+            types.InlineKeyboardButton(text="▶️ Далее", callback_data="search_next")
+        ])
+    keyboard.append([
+        types.InlineKeyboardButton(text="❌ Завершить поиск", callback_data="search_cancel")
+    ])
+    return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+def get_stats_period_keyboard():
+    keyboard = [
+        [
+            types.InlineKeyboardButton(text="📅 За неделю", callback_data="stats_week"),
+            types.InlineKeyboardButton(text="📅 За месяц", callback_data="stats_month"),
+        ],
+        [
+            types.InlineKeyboardButton(text="📅 За квартал", callback_data="stats_quarter"),
+            types.InlineKeyboardButton(text="📅 За год", callback_data="stats_year"),
+        ]
+    ]
+    return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
+
 def setup_scheduler():
     scheduler = AsyncIOScheduler(timezone=moscow_tz)
     scheduler.add_job(
@@ -77,6 +143,15 @@ def setup_scheduler():
         scheduled_reports_task,
         CronTrigger(hour=10, minute=0, timezone=moscow_tz),
     )
+    scheduler.add_job(
+        maintain_message_partitions,
+        CronTrigger(hour=3, minute=0, timezone=moscow_tz),
+    )
+    if FSM_STORAGE == "postgres":
+        scheduler.add_job(
+            scheduled_fsm_cleanup_task,
+            CronTrigger(hour=4, minute=0, timezone=moscow_tz),
+        )
     return scheduler
 
 async def scheduled_avito_task():
@@ -87,30 +162,146 @@ async def scheduled_llm_task():
 
 async def scheduled_reports_task():
     await send_reports_on_timer()      
+
+async def scheduled_fsm_cleanup_task():
+    try:
+        await database.delete_expired_fsm_sessions(fsm_storage.FSM_TTL)
+    except Exception as e:
+        logger.error(f"Ошибка очистки FSM-сессий: {e}")
                
-async def main_avito_data():
+async def fetch_chat_messages(token, chat_id, stop_at_known=True, archived_before=None):
+    mapped_messages = []
+    cutoff = archived_before.timestamp() if archived_before else None
+    async for raw_messages in avito.iter_avito_messages(token, chat_id, USER_ID):
+        # Сообщения старше выгруженных в архив партиций повторно не загружаем
+        reached_archive = False
+        if cutoff is not None:
+            page_messages = raw_messages.get('messages', [])
+            kept_messages = [message for message in page_messages if message.get('created', 0) >= cutoff]
+            reached_archive = len(kept_messages) < len(page_messages)
+            raw_messages = {**raw_messages, 'messages': kept_messages}
+
+        page_messages = utils.map_avito_messages(raw_messages, chat_id)
+        mapped_messages.extend(page_messages)
+
+        if reached_archive:
+            break
+
+        if stop_at_known and page_messages:
+            page_ids = {message['message_id'] for message in page_messages}
+            known_ids = await database.get_known_message_ids(list(page_ids))
+            # Вебхук сохраняет свежие сообщения заранее, поэтому при нем пропуски до них
+            # видны только по странице, целиком состоящей из известных сообщений
+            if AVITO_WEBHOOK_ENABLED:
+                reached_known = known_ids >= page_ids
+            else:
+                reached_known = bool(known_ids)
+            if reached_known:
+                break
+
+    return mapped_messages
+
+async def write_messages(queue):
+    loop = asyncio.get_running_loop()
+    batch_messages = []
+    batch_chats = []
+    saved_count = 0
+    deadline = loop.time() + AVITO_FLUSH_INTERVAL
+
+    async def flush():
+        nonlocal batch_messages, batch_chats, saved_count
+        if batch_chats:
+            try:
+                saved_count += await database.save_messages_to_db(batch_messages)
+                await database.mark_chats_synced(batch_chats)
+            except Exception as e:
+                logger.error(f"Ошибка записи пакета сообщений ({len(batch_chats)} чатов): {e}")
+        batch_messages = []
+        batch_chats = []
+
+    while True:
+        try:
+            item = await asyncio.wait_for(queue.get(), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            await flush()
+            deadline = loop.time() + AVITO_FLUSH_INTERVAL
+            continue
+
+        if item is None:
+            await flush()
+            return saved_count
+
+        chat_id, mapped_messages = item
+        batch_chats.append(chat_id)
+        batch_messages.extend(mapped_messages)
+
+        if len(batch_messages) >= AVITO_WRITE_BATCH:
+            await flush()
+            deadline = loop.time() + AVITO_FLUSH_INTERVAL
+
+async def main_avito_data(full_resync=False):
     try:
         token = await avito.get_avito_token()
-        raw_data_chats = await avito.get_avito_chats(token, USER_ID)
-        map_data_chats = utils.map_avito_chats(raw_data_chats, USER_ID)
-        await database.save_chats_to_db(map_data_chats)
+        changed_count = 0
+        async for raw_data_chats in avito.iter_avito_chats(token, USER_ID):
+            map_data_chats = utils.map_avito_chats(raw_data_chats, USER_ID)
+            changed_count += await database.save_chats_to_db(map_data_chats)
     
-        all_messages_to_save = []
-        chats_list = await database.get_chat_from_db()
+        if full_resync:
+            chats_list = await database.get_chat_from_db()
+        else:
+            chats_list = await database.get_chats_for_sync()
 
-        logger.info("Чаты получены, начинаю синхронизацию сообщений...")
-        
-        for chat_id in chats_list:
-            raw_messages = await avito.get_avito_messages(token, chat_id, USER_ID)
-            mapped_messages = utils.map_avito_messages(raw_messages, chat_id)
-            all_messages_to_save.extend(mapped_messages)
-        
-        await database.save_messages_to_db(all_messages_to_save)
-        logger.info("Cинхронизация данных с Авито завершена успешно")
+        logger.info(f"Чаты получены (изменено: {changed_count}, к синхронизации: {len(chats_list)}), начинаю синхронизацию сообщений...")
+
+        archived_before = await database.get_messages_archived_before()
+
+        queue = asyncio.Queue(maxsize=AVITO_QUEUE_SIZE)
+        semaphore = asyncio.Semaphore(AVITO_SYNC_WORKERS)
+
+        async def process_chat(chat_id):
+            async with semaphore:
+                try:
+                    mapped_messages = await fetch_chat_messages(
+                        token, chat_id, stop_at_known=not full_resync, archived_before=archived_before
+                    )
+                    await queue.put((chat_id, mapped_messages))
+                    return True
+
+                except Exception as e:
+                    logger.error(f"Ошибка при загрузке сообщений чата {chat_id}: {e}")
+                    return False
+
+        writer = asyncio.create_task(write_messages(queue))
+        try:
+            tasks = [process_chat(chat_id) for chat_id in chats_list]
+            results = await asyncio.gather(*tasks)
+        finally:
+            await queue.put(None)
+            saved_count = await writer
+
+        failed_count = results.count(False)
+        if failed_count:
+            logger.warning(f"Не удалось загрузить сообщения для {failed_count} из {len(chats_list)} чатов")
+        logger.info(f"Cинхронизация данных с Авито завершена успешно, сохранено сообщений: {saved_count}")
     
     except Exception as e:
         logger.error(f"Ошибка функции main_avito_data: {e}")
         
+def choose_analysis_mode(chat_data):
+    previous_report = chat_data['previous_report']
+    if previous_report is None or chat_data['report_prompt_version'] != utils.PROMPT_VERSION:
+        return 'full'
+    if chat_data['total_messages'] < LLM_INCREMENTAL_MIN_MESSAGES:
+        return 'full'
+    if not 0 < chat_data['new_messages'] <= LLM_INCREMENTAL_MAX_NEW_MESSAGES:
+        return 'full'
+    if previous_report['incremental_runs'] >= LLM_FULL_REANALYSIS_RUNS:
+        return 'full'
+    if previous_report['full_analyzed_at'] is None or previous_report['full_analysis_age_days'] >= LLM_FULL_REANALYSIS_DAYS:
+        return 'full'
+    return 'incremental'
+
 async def main_llm_data():
     try:
         logger.info("Получение чатов для анализа")
@@ -121,32 +312,184 @@ async def main_llm_data():
 
         logger.info("Чаты получены, начинаю анализ...")
 
-        semaphore = asyncio.Semaphore(10)
+        queue = asyncio.Queue(maxsize=LLM_BATCH_SIZE)
+        skipped_chats = []
+        incremental_chats = []
+        trimmed_chats = []
+
+        packed_chats = []
+        run_id = str(uuid.uuid4())
+        run_usage = {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cached_tokens': 0}
+
+        async def analyse(prompt_data, chat_ids, analysis_mode):
+            analysis_result, usage = await llm.send_to_deepseek(prompt_data)
+            run_usage['calls'] += 1
+            for key, value in usage.items():
+                run_usage[key] += value
+            try:
+                await database.save_llm_usage(run_id, chat_ids, analysis_mode, usage)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения расхода токенов для чатов {chat_ids}: {e}")
+            return analysis_result
+
+        def prepare_chat(chat_data):
+            chat_data['dialog_hash'] = utils.get_dialog_hash(chat_data)
+            chat_data['unchanged'] = (
+                chat_data['dialog_hash'] == chat_data['report_dialog_hash']
+                and chat_data['report_prompt_version'] == utils.PROMPT_VERSION
+            )
+            chat_data['analysis_mode'] = choose_analysis_mode(chat_data)
+            chat_data['dialog_tokens'] = utils.estimate_tokens(utils.format_dialog(chat_data['messages']))
+
+        def is_packable(chat_data):
+            return (
+                LLM_PACK_MAX_CHATS > 1
+                and not chat_data['unchanged']
+                and chat_data['analysis_mode'] == 'full'
+                and chat_data['dialog_tokens'] <= LLM_PACK_CHAT_TOKENS
+            )
 
-        async def process_chat(chat_id):
-            async with semaphore:
+        async def save_analysis(chat_data, analysis_result):
+            mapped_data = utils.map_response_llm(analysis_result, chat_data['chat_id'], chat_data)
+            await database.save_reports_to_db(mapped_data)
+
+        async def process_chat(chat_data):
+            chat_id = chat_data['chat_id']
+            try:
+                if chat_data['unchanged']:
+                    await database.mark_report_checked(chat_id, datetime.now())
+                    skipped_chats.append(chat_id)
+                    return
+
+                if chat_data['analysis_mode'] == 'incremental':
+                    prompt_data = utils.create_incremental_prompt(chat_data, LLM_DIALOG_TOKEN_BUDGET)
+                else:
+                    prompt_data = utils.create_prompt(chat_data, LLM_DIALOG_TOKEN_BUDGET)
+
+                chat_data['dialog_stats'] = prompt_data['dialog_stats']
+                if prompt_data['dialog_stats']['trimmed_tokens']:
+                    trimmed_chats.append(chat_id)
+
+                analysis_result = await analyse(prompt_data, [chat_id], chat_data['analysis_mode'])
+                if chat_data['analysis_mode'] == 'incremental':
+                    analysis_result = utils.merge_incremental_result(chat_data['previous_report'], analysis_result)
+                    incremental_chats.append(chat_id)
+                await save_analysis(chat_data, analysis_result)
+
+            except Exception as e:
+                logger.error(f"Ошибка при обработке чата {chat_id}: {e}")
+
+        async def process_pack(pack):
+            chat_ids = [chat_data['chat_id'] for chat_data in pack]
+            try:
+                prompt_data = utils.create_batch_prompt(pack, LLM_DIALOG_TOKEN_BUDGET)
+                analysis_results = utils.split_batch_response(await analyse(prompt_data, chat_ids, 'batch'), chat_ids)
+            except Exception as e:
+                logger.error(f"Ошибка пакетного анализа чатов {chat_ids}: {e}")
+                analysis_results = {}
+
+            for chat_data in pack:
+                chat_id = chat_data['chat_id']
+                if chat_id not in analysis_results:
+                    logger.warning(f"Чат {chat_id} не разобран в пакетном ответе, анализирую отдельно")
+                    await process_chat(chat_data)
+                    continue
                 try:
-                    chat_data = await database.get_chat_data_for_analysis(chat_id)
-                    prompt_data = utils.create_prompt(chat_data)
-                    analysis_result = await llm.send_to_deepseek(prompt_data)
-                    mapped_data = utils.map_response_llm(analysis_result, chat_id, chat_data)
-                    await database.save_reports_to_db(mapped_data)
-
+                    chat_data['dialog_stats'] = prompt_data['dialog_stats'][chat_id]
+                    await save_analysis(chat_data, analysis_results[chat_id])
+                    packed_chats.append(chat_id)
                 except Exception as e:
                     logger.error(f"Ошибка при обработке чата {chat_id}: {e}")
-    
-        tasks = [process_chat(chat_id) for chat_id in chat_ids]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        async def worker():
+            while True:
+                job = await queue.get()
+                if job is None:
+                    return
+                if len(job) == 1:
+                    await process_chat(job[0])
+                else:
+                    await process_pack(job)
+
+        # Фактическое число одновременных запросов к DeepSeek регулирует llm.llm_limiter
+        workers = [asyncio.create_task(worker()) for _ in range(llm.LLM_MAX_CONCURRENCY)]
+        try:
+            pack = []
+            pack_tokens = 0
+            for i in range(0, len(chat_ids), LLM_BATCH_SIZE):
+                chats_data = await database.get_chats_data_for_analysis(chat_ids[i:i + LLM_BATCH_SIZE])
+                for chat_data in chats_data:
+                    prepare_chat(chat_data)
+                    if not is_packable(chat_data):
+                        await queue.put([chat_data])
+                        continue
+
+                    if pack and (len(pack) >= LLM_PACK_MAX_CHATS
+                                 or pack_tokens + chat_data['dialog_tokens'] > LLM_PACK_TOKEN_BUDGET):
+                        await queue.put(pack)
+                        pack = []
+                        pack_tokens = 0
+                    pack.append(chat_data)
+                    pack_tokens += chat_data['dialog_tokens']
+            if pack:
+                await queue.put(pack)
+        finally:
+            for _ in workers:
+                await queue.put(None)
+            results = await asyncio.gather(*workers, return_exceptions=True)
     
         for result in results:
             if isinstance(result, Exception):
                 logger.error(f"Ошибка задачи: {result}")
     
-        logger.info(f"Анализ {len(chat_ids)} чатов завершен")
+        logger.info(
+            f"Анализ {len(chat_ids)} чатов завершен, без изменений диалога пропущено: {len(skipped_chats)}, "
+            f"инкрементально: {len(incremental_chats)}, пакетами: {len(packed_chats)}, "
+            f"с сокращенным диалогом: {len(trimmed_chats)}"
+        )
+        logger.info(f"Параллельность запросов к DeepSeek: {llm.llm_limiter.get_stats()}")
+        cache_hit_rate = run_usage['cached_tokens'] / run_usage['prompt_tokens'] * 100 if run_usage['prompt_tokens'] else 0
+        logger.info(
+            f"Расход токенов DeepSeek (запуск {run_id}): запросов {run_usage['calls']}, "
+            f"prompt {run_usage['prompt_tokens']}, из кэша {run_usage['cached_tokens']} ({cache_hit_rate:.1f}%), "
+            f"completion {run_usage['completion_tokens']}"
+        )
 
     except Exception as e:
         logger.error(f"Ошибка функции main_llm_data: {e}")
  
+async def maintain_message_partitions():
+    try:
+        created = await database.ensure_message_partitions(MESSAGES_PARTITIONS_AHEAD)
+        logger.info(f"Партиции сообщений готовы до {created[-1]}")
+
+        if not MESSAGES_RETENTION_MONTHS:
+            return
+
+        now = datetime.now()
+        cutoff_month = now.year * 12 + now.month - 1 - MESSAGES_RETENTION_MONTHS
+        cutoff_name = f"messages_{cutoff_month // 12:04d}_{cutoff_month % 12 + 1:02d}"
+        os.makedirs(MESSAGES_ARCHIVE_DIR, exist_ok=True)
+
+        for partition_name in await database.get_message_partitions():
+            if not re.fullmatch(r"messages_\d{4}_\d{2}", partition_name) or partition_name >= cutoff_name:
+                continue
+            archive_path = os.path.join(MESSAGES_ARCHIVE_DIR, f"{partition_name}.csv.gz")
+            await database.archive_message_partition(partition_name, archive_path)
+            logger.info(f"Партиция {partition_name} выгружена в {archive_path} и удалена")
+
+        # Старая история, загруженная до появления месячных партиций, лежит в партиции по умолчанию
+        archive_path = os.path.join(
+            MESSAGES_ARCHIVE_DIR,
+            f"messages_default_before_{cutoff_name.removeprefix('messages_')}_{now:%Y%m%d%H%M%S}.csv.gz"
+        )
+        archived_count = await database.archive_default_messages(cutoff_name, archive_path)
+        if archived_count:
+            logger.info(f"Сообщения из партиции по умолчанию ({archived_count}) выгружены в {archive_path} и удалены")
+
+    except Exception as e:
+        logger.error(f"Ошибка обслуживания партиций сообщений: {e}")
+
 async def send_reports_on_timer():
     try:    
         yesterday = datetime.now() - timedelta(days=1)
@@ -176,13 +519,41 @@ async def send_reports_on_timer():
     except Exception as e:
         logger.error(f"Ошибка в функции send_reports_on_timer: {e}")       
 
+async def start_reports_browsing(chat_id, state: FSMContext, start_date, end_date):
+    total_reports = await database.count_reports_in_period(start_date, end_date)
+    if not total_reports:
+        return False
+
+    await state.update_data(
+        start_date=start_date.isoformat(),
+        end_date=end_date.isoformat(),
+        cursor=None,
+        current_index=0,
+        total_reports=total_reports
+    )
+
+    await show_single_report(chat_id, state)
+    return True
+
 async def show_single_report(chat_id, state: FSMContext):
     data = await state.get_data()
-    reports = data['reports']
     current_index = data['current_index']
     total_reports = data['total_reports']
-    
-    report = reports[current_index]
+    cursor = data.get('cursor')
+    if cursor:
+        cursor = {'created_at': datetime.fromisoformat(cursor['created_at']), 'chat_id': cursor['chat_id']}
+
+    reports = await database.get_reports_page(
+        datetime.fromisoformat(data['start_date']),
+        datetime.fromisoformat(data['end_date']),
+        cursor
+    )
+    if not reports:
+        await bot.send_message(chat_id=chat_id, text="✅ <b>Больше отчетов нет</b>", parse_mode='HTML')
+        await state.clear()
+        return
+
+    report = reports[0]
     report_text = utils.format_single_report(report)
 
     header = f"📊 Сформировано отчетов: {total_reports}\n"
@@ -205,8 +576,50 @@ async def show_single_report(chat_id, state: FSMContext):
             reply_markup=get_reports_navigation_keyboard(current_index, total_reports, has_next)
         )
     
+    await state.update_data(
+        cursor={'created_at': report['created_at'].isoformat(), 'chat_id': report['chat_id']}
+    )
     await state.set_state(ReportState.showing_reports)
 
+async def show_search_results(chat_id, state: FSMContext, message_id=None):
+    data = await state.get_data()
+    search_text = data['search_text']
+    offset = data['search_offset']
+
+    results = await database.search_dialogs(search_text, SEARCH_PAGE_SIZE, offset)
+    if not results:
+        await bot.send_message(
+            chat_id=chat_id,
+            text=f"❌ <b>По запросу «{html.escape(search_text)}» ничего не найдено</b>",
+            parse_mode='HTML'
+        )
+        await state.clear()
+        return
+
+    has_next = offset + len(results) < results[0]['total_count']
+    text = utils.format_search_results(results, search_text, offset)
+    if message_id is None:
+        await bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            parse_mode='HTML',
+            reply_markup=get_search_navigation_keyboard(has_next)
+        )
+    else:
+        await bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=text,
+            parse_mode='HTML',
+            reply_markup=get_search_navigation_keyboard(has_next)
+        )
+
+    await state.set_state(SearchState.showing_results)
+
+async def start_search(chat_id, state: FSMContext, search_text):
+    await state.set_data({'search_text': search_text, 'search_offset': 0})
+    await show_search_results(chat_id, state)
+
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
     user = message.from_user
@@ -257,6 +670,29 @@ async def cmd_report(message: types.Message, state: FSMContext):
     )
     await state.set_state(ReportState.waiting_for_period_selection)
 
+@dp.message(Command("search"))
+async def cmd_search(message: types.Message, command: CommandObject, state: FSMContext):
+    if command.args and command.args.strip():
+        await start_search(message.chat.id, state, command.args.strip())
+        return
+
+    await message.answer(
+        "🔎 <b>Поиск по диалогам и отчетам</b>\n\n"
+        "Введите слова для поиска, например: <i>доставка задержка</i>\n\n"
+        "💡 <b>Для отмены используйте команду</b> /cancel",
+        parse_mode='HTML'
+    )
+    await state.set_state(SearchState.waiting_for_query)
+
+@dp.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    await message.answer(
+        "📈 <b>Статистика качества</b>\n\n"
+        "Выберите период:",
+        parse_mode='HTML',
+        reply_markup=get_stats_period_keyboard()
+    )
+
 @dp.message(Command("cancel"))
 async def cmd_cancel(message: types.Message, state: FSMContext):
     current_state = await state.get_state()
@@ -280,6 +716,8 @@ async def cmd_help(message: types.Message):
 
 • <b>/start</b> - Запустить бота и ознакомиться с возможностями
 • <b>/report</b> - Сформировать отчет за выбранный период
+• <b>/stats</b> - Статистика оценок за неделю, месяц, квартал или год
+• <b>/search</b> - Поиск по диалогам и отчетам ИИ
 • <b>/help</b> - Показать эту справку
 • <b>/cancel</b> - Отменить операцию
 
@@ -313,6 +751,23 @@ async def cmd_help(message: types.Message):
 """
     await message.answer(help_text, parse_mode='HTML')
 
+@dp.callback_query(lambda c: c.data in STATS_PERIODS)
+async def process_stats_period(callback: types.CallbackQuery):
+    end_day = datetime.now().date()
+    start_day = end_day - timedelta(days=STATS_PERIODS[callback.data])
+
+    stats = await database.get_report_stats(start_day, end_day)
+    if not stats:
+        await callback.message.edit_text("❌ <b>Отчеты за выбранный период отсутствуют</b>", parse_mode='HTML')
+        await callback.answer()
+        return
+
+    await callback.message.edit_text(
+        utils.format_period_stats(stats, start_day, end_day),
+        parse_mode='HTML'
+    )
+    await callback.answer()
+
 @dp.callback_query(ReportState.waiting_for_period_selection)
 async def process_period_selection(callback: types.CallbackQuery, state: FSMContext):
     now = datetime.now()
@@ -353,21 +808,12 @@ async def process_period_selection(callback: types.CallbackQuery, state: FSMCont
     
     await callback.message.edit_text(f"🔍 <b>Отчеты за {period_text}...</b>", parse_mode='HTML')
     
-    reports = await database.get_reports_from_db(start_date, end_date)
-
-    if not reports:
+    if not await start_reports_browsing(callback.message.chat.id, state, start_date, end_date):
         await callback.message.edit_text(f"❌ <b>Отчеты за {period_text} отсутствуют</b>", parse_mode='HTML')
         await state.clear()
         await callback.answer()
         return
-    
-    await state.update_data(
-        reports=reports,
-        current_index=0,
-        total_reports=len(reports)
-    )
 
-    await show_single_report(callback.message.chat.id, state)
     await callback.answer()
 
 @dp.message(ReportState.waiting_for_period_selection)
@@ -396,7 +842,7 @@ async def process_start_date(message: types.Message, state: FSMContext):
         return
     try:
         start_date = datetime.strptime(message.text, '%d.%m.%Y')
-        await state.update_data(start_date=start_date)
+        await state.update_data(start_date=start_date.isoformat())
         await message.answer(
             "📊 <b>Формирование отчета за период</b>\n\n"
             "👟 <b>Шаг 2 из 2:</b> Введите конечную дату\n\n"
@@ -438,22 +884,12 @@ async def process_end_date(message: types.Message, state: FSMContext):
         end_date_input = datetime.strptime(message.text, '%d.%m.%Y')
         end_date = end_date_input.replace(hour=23, minute=59, second=59)
         data = await state.get_data()
-        start_date = data['start_date']
+        start_date = datetime.fromisoformat(data['start_date'])
         
-        reports = await database.get_reports_from_db(start_date, end_date)
-
-        if not reports:
+        if not await start_reports_browsing(message.chat.id, state, start_date, end_date):
             await message.answer("❌ <b>Отчеты за указанный период отсутствуют</b>", parse_mode='HTML')
             await state.clear()
             return
-        
-        await state.update_data(
-            reports=reports,
-            current_index=0,
-            total_reports=len(reports)
-        )
-
-        await show_single_report(message.chat.id, state)
 
     except ValueError:
         await message.answer(
@@ -479,6 +915,31 @@ async def next_report_handler(callback: types.CallbackQuery, state: FSMContext):
     await show_single_report(callback.message.chat.id, state)
     await callback.answer()
 
+@dp.message(SearchState.waiting_for_query)
+async def process_search_query(message: types.Message, state: FSMContext):
+    if message.text == '/cancel':
+        await cmd_cancel(message, state)
+        return
+    if not message.text or not message.text.strip():
+        await message.answer("❌ <b>Введите текст для поиска</b>", parse_mode='HTML')
+        return
+
+    await start_search(message.chat.id, state, message.text.strip())
+
+@dp.callback_query(lambda c: c.data == "search_next", SearchState.showing_results)
+async def next_search_page_handler(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await state.update_data(search_offset=data['search_offset'] + SEARCH_PAGE_SIZE)
+
+    await show_search_results(callback.message.chat.id, state, callback.message.message_id)
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data == "search_cancel", SearchState.showing_results)
+async def cancel_search_handler(callback: types.CallbackQuery, state: FSMContext):
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await state.clear()
+    await callback.answer("Поиск завершен")
+
 @dp.callback_query(lambda c: c.data == "cancel_reports", ReportState.showing_reports)
 async def cancel_reports_handler(callback: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
@@ -503,6 +964,8 @@ async def block_all_messages(message: types.Message, state: FSMContext):
             "Доступные команды:\n"
             "• /start - Запустить бота\n"  
             "• /report - Сформировать отчет за период\n"
+            "• /stats - Статистика качества за период\n"
+            "• /search - Поиск по диалогам и отчетам\n"
             "• /cancel - Отменить операцию\n"
             "• /help - Помощь\n",
             parse_mode='HTML',
@@ -512,11 +975,13 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser()
     parser.add_argument('--command')
+    parser.add_argument('--full-resync', action='store_true')
     args = parser.parse_args()
 
     async def main():
         try:
             await database.create_db_pool()
+            await http_client.create_http_session()
             
             if args.command == 'polling':
                 scheduler = setup_scheduler()
@@ -526,16 +991,19 @@ if __name__ == "__main__":
 
             else:
                 if args.command == 'avito':
-                    await main_avito_data()
+                    await main_avito_data(full_resync=args.full_resync)
                 elif args.command == 'llm':
                     await main_llm_data()
                 elif args.command == 'timer':
                     await send_reports_on_timer() 
+                elif args.command == 'partitions':
+                    await maintain_message_partitions()
 
         finally:
             if 'scheduler' in locals():
                 scheduler.shutdown() 
             await database.close_db_pool()
+            await http_client.close_http_session()
             if bot.session:
                 await bot.session.close()
 
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+HTTP_RPS = float(os.getenv("HTTP_RPS", 10))
+HTTP_BURST = int(os.getenv("HTTP_BURST", 10))
+
+RATE_LIMITS = {
+    "api.avito.ru": (
+        float(os.getenv("AVITO_RPS", 5)),
+        int(os.getenv("AVITO_BURST", 10)),
+    ),
+    "api.deepseek.com": (
+        float(os.getenv("DEEPSEEK_RPS", 10)),
+        int(os.getenv("DEEPSEEK_BURST", 20)),
+    ),
+}
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated_at = self.blocked_until
+
+class AdaptiveLimiter:
+    def __init__(self, name, min_limit, max_limit, initial_limit, latency_target,
+                 overload_errors=(), decrease_factor=0.5, window=100):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = max(min_limit, min(initial_limit, max_limit))
+        self.latency_target = latency_target
+        self.overload_errors = overload_errors
+        self.decrease_factor = decrease_factor
+        self.latencies = deque(maxlen=window)
+        self.in_flight = 0
+        self.successes = 0
+        self.decreased_at = 0.0
+        self.stats = {'peak_limit': self.limit, 'increases': 0, 'decreases': 0, 'overloads': 0}
+        self.condition = asyncio.Condition()
+
+    def p95_latency(self):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) if len(ordered) > 1 else 0]
+
+    def _increase(self):
+        if self.limit < self.max_limit:
+            self.limit += 1
+            self.stats['increases'] += 1
+            self.stats['peak_limit'] = max(self.stats['peak_limit'], self.limit)
+        self.successes = 0
+
+    def _decrease(self, reason):
+        limit = max(self.min_limit, int(self.limit * self.decrease_factor))
+        if limit < self.limit:
+            logger.info(f"{self.name}: параллельность снижена {self.limit} -> {limit} ({reason})")
+            self.limit = limit
+            self.stats['decreases'] += 1
+        self.decreased_at = time.monotonic()
+        self.latencies.clear()
+        self.successes = 0
+
+    def _on_success(self, started_at, latency):
+        # Запросы, отправленные до последнего снижения, не отражают текущую нагрузку
+        if started_at < self.decreased_at:
+            return
+        self.latencies.append(latency)
+        self.successes += 1
+        if self.successes < self.limit:
+            return
+        p95 = self.p95_latency()
+        if p95 > self.latency_target:
+            self._decrease(f"p95 {p95:.1f} с")
+        else:
+            self._increase()
+
+    def _on_overload(self, started_at, error):
+        self.stats['overloads'] += 1
+        if started_at >= self.decreased_at:
+            self._decrease(type(error).__name__)
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+        started_at = time.monotonic()
+        try:
+            yield
+        except self.overload_errors as e:
+            self._on_overload(started_at, e)
+            raise
+        else:
+            self._on_success(started_at, time.monotonic() - started_at)
+        finally:
+            async with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def get_stats(self):
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'p95_latency': round(self.p95_latency(), 2),
+            **self.stats,
+        }
+
+limiters = {}
+
+def get_limiter(url):
+    host = urlsplit(str(url)).hostname
+    if host not in limiters:
+        rate, burst = RATE_LIMITS.get(host, (HTTP_RPS, HTTP_BURST))
+        limiters[host] = TokenBucket(rate, burst)
+    return limiters[host]
+
+async def acquire(url):
+    await get_limiter(url).acquire()
+
+def pause(url, seconds):
+    get_limiter(url).pause(seconds)
@@ -1,6 +1,54 @@
-from tenacity import retry, stop_after_attempt, wait_exponential
+import asyncio
+import os
+import aiohttp
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from dotenv import load_dotenv
+from tenacity import retry, stop_after_attempt, wait_random_exponential, retry_if_exception_type
+import rate_limit
+
+load_dotenv()
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", 3))
+RETRY_MAX_WAIT = float(os.getenv("RETRY_MAX_WAIT", 60))
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class RetryableHTTPError(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+
+def raise_for_retryable(response):
+    if response.status in RETRYABLE_STATUSES:
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after:
+            rate_limit.pause(response.url, min(retry_after, RETRY_MAX_WAIT))
+        raise RetryableHTTPError(response.status, retry_after)
+
+jitter_wait = wait_random_exponential(multiplier=1, min=2, max=10)
+
+def wait_retry_after(retry_state):
+    error = retry_state.outcome.exception()
+    if isinstance(error, RetryableHTTPError) and error.retry_after is not None:
+        return min(error.retry_after, RETRY_MAX_WAIT)
+    return jitter_wait(retry_state)
 
 api_retry = retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=10),
-)
\ No newline at end of file
+    stop=stop_after_attempt(RETRY_ATTEMPTS),
+    wait=wait_retry_after,
+    retry=retry_if_exception_type((RetryableHTTPError, aiohttp.ClientConnectionError, asyncio.TimeoutError)),
+)
@@ -1,4 +1,7 @@
+import hashlib
+import html
 from datetime import datetime
+import json_codec
 
 def map_avito_chats(raw_chats_data, DIKON_ID):
     mapped_chats = []
@@ -42,6 +45,26 @@ def map_avito_messages(raw_messages_data, chat_id):
 
     return mapped_messages
 
+def map_avito_webhook_message(webhook_data, DIKON_ID):
+    payload = webhook_data.get('payload') or {}
+    if payload.get('type') != 'message':
+        return None
+
+    message = payload.get('value') or {}
+    if message.get('type') == 'system':
+        return None
+    if not message.get('id') or not message.get('chat_id') or not message.get('created'):
+        return None
+
+    mapped_message = {
+        'chat_id': message['chat_id'],
+        'message_id': message['id'],
+        'text': (message.get('content') or {}).get('text', ''),
+        'is_from_company': str(message.get('author_id')) == str(DIKON_ID),
+        'created_at': datetime.fromtimestamp(message['created']),
+    }
+    return mapped_message
+
 def map_response_llm (response, chat_id, chat_data):
     chat_title = chat_data.get('chat_title', '')
     client_name = chat_data.get('chat_client_name', '')
@@ -50,10 +73,21 @@ def map_response_llm (response, chat_id, chat_data):
     total_messages = chat_data.get('total_messages', 0)
     company_messages = chat_data.get('company_messages', 0)
     client_messages = chat_data.get('client_messages', 0)
+    analysis_mode = chat_data.get('analysis_mode', 'full')
+    dialog_stats = chat_data.get('dialog_stats') or {}
+    created_at = datetime.now()
+
+    if analysis_mode == 'incremental':
+        previous_report = chat_data['previous_report']
+        incremental_runs = previous_report['incremental_runs'] + 1
+        full_analyzed_at = previous_report['full_analyzed_at']
+    else:
+        incremental_runs = 0
+        full_analyzed_at = created_at
     
     mapped_data = {
         'chat_id': chat_id,
-        'created_at': datetime.now(),
+        'created_at': created_at,
         'chat_title': chat_title,
         'client_name': client_name,
         'chat_created_at': chat_created_at,
@@ -74,34 +108,29 @@ def map_response_llm (response, chat_id, chat_data):
         'closure_grade': response.get('closure', {}).get('grade', ''),
         'closure_comment': response.get('closure', {}).get('comment', ''),
         'summary': response.get('summary', ''),
-        'recommendations': response.get('recommendations', '')
+        'recommendations': response.get('recommendations', ''),
+        'dialog_hash': chat_data.get('dialog_hash'),
+        'prompt_version': PROMPT_VERSION,
+        'analysis_mode': analysis_mode,
+        'incremental_runs': incremental_runs,
+        'full_analyzed_at': full_analyzed_at,
+        'analyzed_until': chat_data.get('last_message_at'),
+        'dialog_tokens': dialog_stats.get('dialog_tokens', 0),
+        'trimmed_tokens': dialog_stats.get('trimmed_tokens', 0),
+        'trimmed_messages': dialog_stats.get('trimmed_messages', 0),
+        'deduplicated_messages': dialog_stats.get('deduplicated_messages', 0)
     }
     return mapped_data
 
-def create_prompt(chat_data):
-    messages = chat_data['messages']
-    formatted_lines = []
-    for msg in messages:
-        role = "[МЕНЕДЖЕР]" if msg['is_from_company'] else "[КЛИЕНТ]"
-        message_text = msg['text']
-        formatted_lines.append(f"{role}\n- {message_text}")
-    
-    formatted_dialog = "\n\n".join(formatted_lines)
-    
-    system_prompt = """
+SYSTEM_PROMPT = """
 Ты — AI-ассистент для контроля качества коммуникации менеджеров в компании.
 Твоя задача — строго проанализировать диалог и вернуть ответ в формате JSON, без любых других пояснений до или после.
 ВСЕГДА следуй предложенной схеме JSON.
 ВСЕ части ответа, включая комментарии и рекомендации, ДОЛЖНЫ быть написаны на РУССКОМ ЯЗЫКЕ.
 ЗАПРЕЩЕНО использовать английские слова и термины.
 """.strip()
-    
-    user_prompt = f"""
-Проанализируй диалог менеджера с клиентом в чате "{chat_data['chat_title']}".
-Учти, что [КЛИЕНТ] — это потенциальный покупатель, а [МЕНЕДЖЕР] — это сотрудник компании.
-
-Сообщения от КОМПАНИИ помечены [МЕНЕДЖЕР], от КЛИЕНТА - [КЛИЕНТ].
 
+ANALYSIS_INSTRUCTIONS = """
 ПРОАНАЛИЗИРУЙ СООБЩЕНИЯ [МЕНЕДЖЕР] и дай развернутую оценку по следующим критериям. Для каждого критерия дай ОБЩУЮ ОЦЕНКУ ("Высокая", "Средняя", "Низкая") и КРАТКОЕ ПОЯСНЕНИЕ на 1-2 предложения на русском языке.
 
 КРИТЕРИИ:
@@ -120,44 +149,256 @@ def create_prompt(chat_data):
 
 ВЕРНИ ОТВЕТ В ФОРМАТЕ JSON СТРОГО И ТОЧНО ПО СЛЕДУЮЩЕЙ СХЕМЕ. НЕ ДОБАВЛЯЙ никаких других полей.
 
-{{
-  "tonality": {{
+{
+  "tonality": {
     "grade": "Высокая",
     "comment": "Менеджер сохранял доброжелательный и уважительный тон на протяжении всего диалога."
-  }},
-  "professionalism": {{
+  },
+  "professionalism": {
     "grade": "Средняя", 
     "comment": "Использовал корректную терминологию, но не уточнил важные технические детали по установке."
-  }},
-  "clarity": {{
+  },
+  "clarity": {
     "grade": "Высокая",
     "comment": "Ответы были четкими и по делу, клиенту было легко понять варианты и цены."
-  }},
-  "problem_solving": {{
+  },
+  "problem_solving": {
     "grade": "Низкая",
     "comment": "Не предложил альтернативу при отказе клиента от дорогого варианта."
-  }},
-  "objection_handling": {{
+  },
+  "objection_handling": {
     "grade": "Нет возражений",
     "comment": "В диалоге возражений со стороны клиента не было."
-  }},
-  "closure": {{
+  },
+  "closure": {
     "grade": "Высокая",
     "comment": "Диалог завершен корректно, клиент приглашен для дальнейшего обращения."
-  }},
+  },
   "summary": "Менеджер вежлив и коммуникабелен, но не проявил гибкости в продажах. Клиент ушел на подумать без конкретного решения.",
   "recommendations": "Отработать технику предложения альтернатив. Заранее готовить ответы на частые возражения по цене."
-}}
+}
+""".strip()
+
+DIALOG_ROLES_NOTE = """
+Учти, что [КЛИЕНТ] — это потенциальный покупатель, а [МЕНЕДЖЕР] — это сотрудник компании.
+
+Сообщения от КОМПАНИИ помечены [МЕНЕДЖЕР], от КЛИЕНТА - [КЛИЕНТ].
+""".strip()
+
+# Статические инструкции идут первыми и не меняются между запросами, чтобы DeepSeek переиспользовал кэш префикса
+ANALYSIS_SYSTEM_PROMPT = "\n\n".join([SYSTEM_PROMPT, DIALOG_ROLES_NOTE, ANALYSIS_INSTRUCTIONS])
+
+USER_PROMPT_TEMPLATE = """
+Проанализируй диалог менеджера с клиентом по критериям и схеме, описанным выше.
+
+ЧАТ: "{chat_title}"
 
 ДИАЛОГ:
 {formatted_dialog}
 """.strip()
+
+INCREMENTAL_PROMPT_TEMPLATE = """
+Диалог менеджера с клиентом уже был проанализирован ранее, с тех пор в нем появились новые сообщения.
+ОБНОВИ ОТЧЕТ С УЧЕТОМ НОВЫХ СООБЩЕНИЙ по критериям и схеме, описанным выше. Оценки и комментарии, на которые новые сообщения не влияют, оставь без изменений. Итоговая оценка и рекомендации должны описывать весь диалог целиком, а не только новые сообщения.
+
+ЧАТ: "{chat_title}"
+
+ПРЕДЫДУЩИЙ ОТЧЕТ ПО ДИАЛОГУ:
+{previous_report}
+
+НОВЫЕ СООБЩЕНИЯ:
+{formatted_dialog}
+""".strip()
+
+BATCH_PROMPT_TEMPLATE = """
+Проанализируй несколько независимых диалогов менеджеров с клиентами по критериям, описанным выше. Каждый диалог начинается со строки вида "=== ЧАТ <идентификатор чата>: <название чата> ===".
+Оценивай КАЖДЫЙ диалог отдельно, не смешивая их между собой.
+ВЕРНИ ОДИН JSON-ОБЪЕКТ, в котором ключ — идентификатор чата, а значение — отчет по этому чату строго по схеме выше.
+
+В ответе должны быть отчеты по ВСЕМ чатам: {chat_ids}
+
+ДИАЛОГИ:
+{formatted_dialogs}
+""".strip()
+
+PROMPT_VERSION = hashlib.sha256(
+    (ANALYSIS_SYSTEM_PROMPT + USER_PROMPT_TEMPLATE + INCREMENTAL_PROMPT_TEMPLATE + BATCH_PROMPT_TEMPLATE).encode()
+).hexdigest()[:16]
+
+REPORT_CRITERIA = [
+    'tonality',
+    'professionalism',
+    'clarity',
+    'problem_solving',
+    'objection_handling',
+    'closure',
+]
+
+CHARS_PER_TOKEN = 3
+DIALOG_HEAD_SHARE = 0.3
+MESSAGE_MAX_TOKENS = 500
+BOILERPLATE_MIN_CHARS = 40
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def format_message(msg):
+    role = "[МЕНЕДЖЕР]" if msg['is_from_company'] else "[КЛИЕНТ]"
+    return f"{role}\n- {msg['text']}"
+
+def format_dialog(messages):
+    formatted_lines = [format_message(msg) for msg in messages]
+    
+    return "\n\n".join(formatted_lines)
+
+def compress_dialog(messages, token_budget):
+    stats = {
+        'dialog_tokens': 0,
+        'trimmed_tokens': 0,
+        'trimmed_messages': 0,
+        'deduplicated_messages': 0,
+    }
+    max_message_chars = MESSAGE_MAX_TOKENS * CHARS_PER_TOKEN
+    seen_templates = set()
+    blocks = []
+
+    for msg in messages:
+        text = msg['text'] or ''
+        stats['dialog_tokens'] += estimate_tokens(format_message(msg))
+
+        if msg['is_from_company'] and len(text) >= BOILERPLATE_MIN_CHARS:
+            template = ' '.join(text.lower().split())
+            if template in seen_templates:
+                text = "(повтор шаблонного сообщения)"
+                stats['deduplicated_messages'] += 1
+            seen_templates.add(template)
+
+        if len(text) > max_message_chars:
+            text = text[:max_message_chars] + "…"
+
+        blocks.append(format_message({'is_from_company': msg['is_from_company'], 'text': text}))
+
+    block_tokens = [estimate_tokens(block) for block in blocks]
+    if sum(block_tokens) > token_budget:
+        head_budget = int(token_budget * DIALOG_HEAD_SHARE)
+        used = 0
+        head_end = 0
+        while head_end < len(blocks) and used + block_tokens[head_end] <= head_budget:
+            used += block_tokens[head_end]
+            head_end += 1
+
+        tail_start = len(blocks)
+        while tail_start > head_end and used + block_tokens[tail_start - 1] <= token_budget:
+            tail_start -= 1
+            used += block_tokens[tail_start]
+
+        stats['trimmed_messages'] = tail_start - head_end
+        blocks = (
+            blocks[:head_end]
+            + [f"[... пропущено сообщений из середины диалога: {stats['trimmed_messages']} ...]"]
+            + blocks[tail_start:]
+        )
+
+    formatted_dialog = "\n\n".join(blocks)
+    stats['trimmed_tokens'] = max(stats['dialog_tokens'] - estimate_tokens(formatted_dialog), 0)
+    return formatted_dialog, stats
+
+def get_dialog_hash(chat_data):
+    dialog = f"{chat_data['chat_title']}\n{format_dialog(chat_data['messages'])}"
+    return hashlib.sha256(dialog.encode()).hexdigest()
+
+def create_prompt(chat_data, token_budget):
+    formatted_dialog, dialog_stats = compress_dialog(chat_data['messages'], token_budget)
     
+    user_prompt = USER_PROMPT_TEMPLATE.format(
+        chat_title=chat_data['chat_title'],
+        formatted_dialog=formatted_dialog
+    )
+    
+    return {
+        "system": ANALYSIS_SYSTEM_PROMPT,
+        "user": user_prompt,
+        "dialog_stats": dialog_stats
+    }
+
+def format_previous_report(report):
+    previous_report = {
+        criterion: {
+            'grade': report[f'{criterion}_grade'] or '',
+            'comment': report[f'{criterion}_comment'] or '',
+        }
+        for criterion in REPORT_CRITERIA
+    }
+    previous_report['summary'] = report['summary'] or ''
+    previous_report['recommendations'] = report['recommendations'] or ''
+    return json_codec.dumps(previous_report)
+
+def create_incremental_prompt(chat_data, token_budget):
+    new_messages = [msg for msg in chat_data['messages'] if msg.get('is_new')]
+    formatted_dialog, dialog_stats = compress_dialog(new_messages, token_budget)
+
+    user_prompt = INCREMENTAL_PROMPT_TEMPLATE.format(
+        chat_title=chat_data['chat_title'],
+        previous_report=format_previous_report(chat_data['previous_report']),
+        formatted_dialog=formatted_dialog
+    )
+
+    return {
+        "system": ANALYSIS_SYSTEM_PROMPT,
+        "user": user_prompt,
+        "dialog_stats": dialog_stats
+    }
+
+def create_batch_prompt(chats_data, token_budget):
+    formatted_dialogs = []
+    dialog_stats = {}
+    for chat_data in chats_data:
+        formatted_dialog, stats = compress_dialog(chat_data['messages'], token_budget)
+        formatted_dialogs.append(f"=== ЧАТ {chat_data['chat_id']}: {chat_data['chat_title']} ===\n{formatted_dialog}")
+        dialog_stats[chat_data['chat_id']] = stats
+
+    user_prompt = BATCH_PROMPT_TEMPLATE.format(
+        chat_ids=", ".join(chat_data['chat_id'] for chat_data in chats_data),
+        formatted_dialogs="\n\n".join(formatted_dialogs)
+    )
+
+    return {
+        "system": ANALYSIS_SYSTEM_PROMPT,
+        "user": user_prompt,
+        "dialog_stats": dialog_stats,
+        "report_count": len(chats_data)
+    }
+
+def is_valid_report(report):
+    if not isinstance(report, dict):
+        return False
+    for criterion in REPORT_CRITERIA:
+        grade = report.get(criterion)
+        if not isinstance(grade, dict) or not grade.get('grade'):
+            return False
+    return isinstance(report.get('summary'), str) and bool(report['summary'])
+
+def split_batch_response(response, chat_ids):
+    if not isinstance(response, dict):
+        return {}
     return {
-        "system": system_prompt,
-        "user": user_prompt
+        chat_id: response[chat_id]
+        for chat_id in chat_ids
+        if is_valid_report(response.get(chat_id))
     }
 
+def merge_incremental_result(previous_report, response):
+    merged = {}
+    for criterion in REPORT_CRITERIA:
+        updated = response.get(criterion) or {}
+        merged[criterion] = {
+            'grade': updated.get('grade') or previous_report[f'{criterion}_grade'] or '',
+            'comment': updated.get('comment') or previous_report[f'{criterion}_comment'] or '',
+        }
+    merged['summary'] = response.get('summary') or previous_report['summary'] or ''
+    merged['recommendations'] = response.get('recommendations') or previous_report['recommendations'] or ''
+    return merged
+
 def format_single_report(report_data):
     
     grades_text = ""
@@ -195,3 +436,51 @@ def format_single_report(report_data):
 <b>Рекомендации:</b>
 <i>{report_data.get('recommendations', '')}</i>
 """
+
+def format_period_stats(stats, start_day, end_day):
+    criteria = [
+        ("Тональность", "tonality"),
+        ("Профессионализм", "professionalism"),
+        ("Ясность", "clarity"),
+        ("Решение проблем", "problem_solving"),
+        ("Работа с возражениями", "objection_handling"),
+        ("Завершение", "closure")
+    ]
+    grades_by_criterion = {}
+    for row in stats:
+        grades_by_criterion.setdefault(row['criterion'], []).append((row['grade'], row['report_count']))
+
+    total_reports = max((sum(count for _, count in grades) for grades in grades_by_criterion.values()), default=0)
+
+    stats_text = ""
+    for name, criterion in criteria:
+        stats_text += f"• <b>{name}:</b>\n"
+        for grade, count in grades_by_criterion.get(criterion, []):
+            share = count * 100 / total_reports if total_reports else 0
+            stats_text += f"  {grade or 'Без оценки'}: {count} ({share:.0f}%)\n"
+        stats_text += "\n"
+
+    return f"""
+📈 <b>Статистика качества за период</b>
+<b>{start_day.strftime('%d.%m.%Y')} – {end_day.strftime('%d.%m.%Y')}</b>
+
+<b>Всего отчетов:</b> {total_reports}
+
+{stats_text}"""
+
+def format_search_results(results, search_text, offset):
+    total_count = results[0]['total_count'] if results else 0
+    results_text = ""
+    for number, result in enumerate(results, start=offset + 1):
+        source = "отчет ИИ" if result['source'] == 'report' else "диалог"
+        updated_at = result['updated_at'].strftime('%d.%m.%Y') if result.get('updated_at') else ''
+        results_text += f"<b>{number}. {html.escape(result.get('title') or '')}</b>\n"
+        results_text += f"<b>Клиент:</b> {html.escape(result.get('client_name') or '')} ({updated_at})\n"
+        results_text += f"<b>Найдено в:</b> {source}\n"
+        results_text += f"<i>{html.escape(result.get('snippet') or '')}</i>\n\n"
+
+    return f"""
+🔎 <b>Поиск:</b> {html.escape(search_text)}
+<b>Найдено чатов:</b> {total_count}
+
+{results_text}"""